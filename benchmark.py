@@ -0,0 +1,273 @@
+#!/usr/bin/python
+__author__ = 'tal'
+__version__ = '2.0'
+
+import argparse
+import json
+import locale
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TREE_CHECK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tree_check.py')
+
+#Keep git working on boxes that have never had it set up
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='tree_check benchmark', GIT_AUTHOR_EMAIL='benchmark@localhost',
+               GIT_COMMITTER_NAME='tree_check benchmark', GIT_COMMITTER_EMAIL='benchmark@localhost')
+
+
+def _make_file(path, size):
+    #Sparse files, so big trees don't need the disk space
+    with open(path, 'w') as f:
+        f.truncate(size)
+
+
+def make_wide_flat(root, scale):
+    #One dir with a lot of files in it
+    for i in range(20000 * scale):
+        _make_file(os.path.join(root, 'file_%06d' % i), i % 65536)
+
+
+def make_deep_narrow(root, scale):
+    #One long chain of dirs, with a couple of files in each. Kept under PATH_MAX
+    path = root
+    for i in range(min(500 * scale, 1500)):
+        path = os.path.join(path, 'd')
+        os.mkdir(path)
+        _make_file(os.path.join(path, 'a'), i)
+        _make_file(os.path.join(path, 'b'), i * 2)
+
+
+def make_many_small_files(root, scale):
+    #Lots of dirs full of tiny files with real content
+    for i in range(10 * scale):
+        for j in range(10):
+            path = os.path.join(root, 'dir_%03d' % i, 'sub_%02d' % j)
+            os.makedirs(path)
+            for k in range(200):
+                with open(os.path.join(path, 'small_%03d.txt' % k), 'w') as f:
+                    f.write('x' * (k % 100))
+
+
+def make_hard_link_heavy(root, scale):
+    #Every file shows up in 5 dirs
+    for i in range(5):
+        os.mkdir(os.path.join(root, 'links_%d' % i))
+    for i in range(2000 * scale):
+        _make_file(os.path.join(root, 'links_0', 'file_%05d' % i), 4096 + i)
+        for j in range(1, 5):
+            os.link(os.path.join(root, 'links_0', 'file_%05d' % i), os.path.join(root, 'links_%d' % j, 'file_%05d' % i))
+
+
+def make_odd_names(root, scale):
+    #Names that used to break the shell du pipeline, and names that aren't ASCII
+    names = ["it's", 'say "hi"', 'with space', '-dash', '$(echo nope)', '*star*', 'back\\slash',
+             'caf\xc3\xa9', '\xe6\x97\xa5\xe6\x9c\xac', '.hidden']
+    for i in range(200 * scale):
+        path = os.path.join(root, names[i % len(names)] + ' %d' % i)
+        os.mkdir(path)
+        for name in names:
+            _make_file(os.path.join(path, name), i)
+
+
+SHAPES = [('wide_flat', make_wide_flat),
+          ('deep_narrow', make_deep_narrow),
+          ('many_small_files', make_many_small_files),
+          ('hard_link_heavy', make_hard_link_heavy),
+          ('odd_names', make_odd_names)]
+
+#What each stage passes to tree_check.py, on top of --stats. SRC, OUT, GIT and CACHE get filled in. The warm
+#stages run twice with the same cache, output folder and repo, and only the second run is timed, like a cron run
+#on a tree that hasn't changed since the last one
+STAGES = [('scan', ['-f', 'OUT', 'SRC']),
+          ('total', ['-t', 'OUT/totals', 'SRC']),
+          ('git', ['-f', 'OUT', 'SRC', '-g', 'GIT']),
+          ('full', ['-f', 'OUT', 'SRC', '-t', 'OUT/totals', 'SRC', '-g', 'GIT']),
+          ('warm_scan', ['-c', 'CACHE', '-f', 'OUT', 'SRC']),
+          ('warm_full', ['-c', 'CACHE', '-f', 'OUT', 'SRC', '-t', 'OUT/totals', 'SRC', '-g', 'GIT'])]
+
+#Names tree escapes, and what its listing of a folder called 'r\xc3\xa9sum\xc3\xa9' with a file of each in it should
+#start with (the total under it depends on the filesystem), in the C locale cron runs with and in a UTF-8 one
+ESCAPED_NAMES = ['caf\xc3\xa9', '\xe6\x97\xa5\xe6\x9c\xac', 'new\nline', 'bad\xff', 'say "hi"', 'x\xc2\x85y']
+ESCAPED_LISTINGS = {'C': 'r\\303\\251sum\\303\\251\n'
+                         '|-- [   0]  bad\\377\n'
+                         '|-- [   0]  caf\\303\\251\n'
+                         '|-- [   0]  new\\012line\n'
+                         '|-- [   0]  say "hi"\n'
+                         '|-- [   0]  x\\302\\205y\n'
+                         '`-- [   0]  \\346\\227\\245\\346\\234\\254\n',
+                    'C.UTF-8': 'r\xc3\xa9sum\xc3\xa9\n'
+                               '|-- [   0]  bad\\377\n'
+                               '|-- [   0]  caf\xc3\xa9\n'
+                               '|-- [   0]  new\\012line\n'
+                               '|-- [   0]  say "hi"\n'
+                               '|-- [   0]  x\\205y\n'
+                               '`-- [   0]  \xe6\x97\xa5\xe6\x9c\xac\n'}
+
+
+def check_escaped_names():
+    """Return a line for every locale that names in listings aren't escaped in the way tree would escape them."""
+    work_dir = tempfile.mkdtemp(prefix='tree_check_names_')
+    failures = []
+    try:
+        src = os.path.join(work_dir, 'r\xc3\xa9sum\xc3\xa9')
+        os.mkdir(src)
+        for name in ESCAPED_NAMES:
+            _make_file(os.path.join(src, name), 0)
+        os.mkdir(os.path.join(work_dir, 'out'))
+        for name, listing in sorted(ESCAPED_LISTINGS.items()):
+            try:
+                locale.setlocale(locale.LC_CTYPE, name)
+            except locale.Error:
+                continue    # Not installed here
+            finally:
+                locale.setlocale(locale.LC_CTYPE, 'C')
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable, TREE_CHECK, '-f', 'out', os.path.basename(src)], cwd=work_dir,
+                                      stdout=devnull, stderr=devnull, env=dict(os.environ, LC_ALL=name))
+            with open(os.path.join(work_dir, 'out', os.path.basename(src))) as f:
+                found = f.read()
+            if not found.startswith(listing + '\n'):
+                failures.append('names are not escaped like tree does in the %s locale' % name)
+    finally:
+        shutil.rmtree(work_dir)
+    return failures
+
+
+def run_stage(src, stage_args, work_dir):
+    """Run tree_check.py with stage_args in a fresh output folder, and return the timings of its last run.
+
+    Stages that use a cache are run twice, so the timings are of a run that finds everything the first one left.
+    """
+    out_dir = os.path.join(work_dir, 'out')
+    cache_dir = os.path.join(work_dir, 'cache')
+    for path in (out_dir, cache_dir):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.mkdir(path)
+    stats_path = os.path.join(work_dir, 'stats.json')
+    replacements = {'SRC': src, 'OUT': out_dir, 'OUT/totals': os.path.join(out_dir, 'totals'), 'GIT': out_dir,
+                    'CACHE': cache_dir}
+    command = [sys.executable, TREE_CHECK, '--stats', stats_path] + [replacements.get(arg, arg) for arg in stage_args]
+
+    with open(os.devnull, 'w') as devnull:
+        if 'CACHE' in stage_args:
+            subprocess.check_call(command, stdout=devnull, stderr=devnull, env=GIT_ENV)
+        started = time.time()
+        subprocess.check_call(command, stdout=devnull, stderr=devnull, env=GIT_ENV)
+        seconds = time.time() - started
+    with open(stats_path) as f:
+        stats = json.load(f)
+
+    entries = sum(source['entries'] for source in stats['sources'])
+    result = {'seconds': seconds,
+              'walk_seconds': sum(source['seconds'] for source in stats['sources']),
+              'entries_per_second': entries / seconds if seconds else 0.0,
+              'peak_rss_bytes': stats['peak_rss_bytes']}
+    if 'git' in stats:
+        result['git_seconds'] = stats['git']['add_seconds'] + stats['git']['commit_seconds']
+    return result
+
+
+def run_benchmarks(scale, repeat, shapes, stages):
+    """Build every shape, run every stage on it repeat times, and return the best timings of each."""
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='tree_check_benchmark_')
+    try:
+        for shape, make_shape in SHAPES:
+            if shape not in shapes:
+                continue
+            src = os.path.join(work_dir, shape)
+            os.mkdir(src)
+            make_shape(src, scale)
+            results[shape] = {}
+            for stage, stage_args in STAGES:
+                if stage not in stages:
+                    continue
+                runs = [run_stage(src, stage_args, work_dir) for _ in range(repeat)]
+                results[shape][stage] = dict((key, min(run[key] for run in runs)) for key in runs[0])
+            shutil.rmtree(src)
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every time or memory figure in results that got worse than baseline by over tolerance %."""
+    regressions = []
+    for shape in sorted(results):
+        for stage in sorted(results[shape]):
+            for key in ('seconds', 'walk_seconds', 'git_seconds', 'peak_rss_bytes'):
+                old = baseline.get(shape, {}).get(stage, {}).get(key)
+                new = results[shape][stage].get(key)
+                if old and new is not None and new > old * (1 + tolerance / 100.0):
+                    regressions.append('%s/%s: %s went from %.4g to %.4g (+%.1f%%)' %
+                                       (shape, stage, key, old, new, (float(new) / old - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the -f (scan), -t (total) and -g (git) stages of ' +
+                                                 'tree_check.py, and the whole pipeline, cold and with a warm ' +
+                                                 'cache, on synthetic trees')
+    parser.add_argument('--scale', type=int, default=1, help='make every tree SCALE times bigger (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best one counts (default: 3)')
+    parser.add_argument('--shape', action='append', choices=[shape for shape, make_shape in SHAPES],
+                        help='only run this shape of tree (can be given more than once)')
+    parser.add_argument('--stage', action='append', choices=[stage for stage, stage_args in STAGES],
+                        help='only run this stage (can be given more than once)')
+    parser.add_argument('--save', metavar='FILE', help='save the results to FILE, to use as a baseline later')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results to the ones saved in FILE, ' +
+                                                           'and exit with 1 if anything got slower or bigger')
+    parser.add_argument('--tolerance', type=float, default=20, metavar='PERCENT',
+                        help='how much worse than the baseline is still OK (default: 20)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except (IOError, ValueError):
+            parser.error("failed to read '%s' as a baseline" % args.baseline)
+
+    #A listing that's fast but wrong is no good either
+    failures = check_escaped_names()
+    for failure in failures:
+        print >> sys.stderr, '%s: error: %s' % (os.path.basename(__file__), failure)
+    if failures:
+        exit(1)
+
+    results = run_benchmarks(args.scale, args.repeat,
+                             args.shape or [shape for shape, make_shape in SHAPES],
+                             args.stage or [stage for stage, stage_args in STAGES])
+
+    print '%-18s %-9s %10s %10s %10s %14s %10s' % ('shape', 'stage', 'seconds', 'walk', 'git', 'entries/s',
+                                                  'peak RSS')
+    for shape in sorted(results):
+        for stage, stage_args in STAGES:
+            if stage in results[shape]:
+                result = results[shape][stage]
+                print '%-18s %-9s %10.3f %10.3f %10s %14.0f %9.1fM' % (
+                    shape, stage, result['seconds'], result['walk_seconds'],
+                    '%.3f' % result['git_seconds'] if 'git_seconds' in result else '-',
+                    result['entries_per_second'], result['peak_rss_bytes'] / 1024.0 / 1024.0)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+            f.write('\n')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print >> sys.stderr, '%s: regression: %s' % (os.path.basename(__file__), regression)
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2598 @@
+"""Everything behind tree_check.py, which only imports this and runs main().
+
+python caches the compiled bytecode of modules it imports, but compiles the
+script it runs from scratch every time, so keeping the code here saves every
+cron run from compiling all of it.
+"""
+__author__ = 'tal'
+__version__ = '2.0'
+
+import errno
+import hashlib
+import locale
+import marshal
+import mmap
+import os
+import re
+import resource
+import select
+import stat
+import struct
+import sys
+import tempfile
+import time
+import signal
+import threading
+
+START_TIME = time.time()
+
+#Prefer scandir (built in from python 3.5, or the 'scandir' backport) over listdir + lstat
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# noinspection PyUnusedLocal,PyUnusedLocal
+def signal_handler(kill_signal, frame):
+    print   # Newline for formatting
+    sys.exit(0)
+
+#Output files get the same permissions open() would have given them
+_umask = None
+
+
+def _get_umask():
+    #Finding out the umask means changing it for a moment, so main() does it before any threads start
+    global _umask
+    if _umask is None:
+        _umask = os.umask(0)
+        os.umask(_umask)
+    return _umask
+
+
+class Node(object):
+    """A single entry found while walking a source folder.
+
+    For directories, size is the total size of the directory and everything
+    under it that isn't hidden (like 'tree --du'), and children is the sorted
+    list of entries in it. For everything else, children is None. error is
+    the reason a dir could not be read, if it couldn't.
+
+    There can be millions of these, so they only have what they need: use
+    new_node to make them. Only symlinks have a link and link_mode of their
+    own, and only dirs, and every entry of a walk that asks for inodes, have
+    blocks (the disk usage of the entry itself, in bytes), dev, ino and nlink.
+    """
+    __slots__ = ('name', 'mode', 'size', 'mtime', 'children', 'error')
+    link = None
+    link_mode = 0
+
+    def __init__(self, name, st):
+        self.name = name
+        self.mode = st.st_mode
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.children = [] if stat.S_ISDIR(st.st_mode) else None
+        self.error = None
+
+    def is_dir(self):
+        #Symlinks to dirs count as dirs, just like they do in tree
+        return self.children is not None or stat.S_ISDIR(self.link_mode)
+
+
+class _InodeNode(Node):
+    __slots__ = ('blocks', 'dev', 'ino', 'nlink')
+
+    def __init__(self, name, st):
+        Node.__init__(self, name, st)
+        self.blocks = st.st_blocks * 512
+        self.dev = st.st_dev
+        self.ino = st.st_ino
+        self.nlink = st.st_nlink
+
+
+class _LinkNode(Node):
+    __slots__ = ('link', 'link_mode')
+
+
+class _InodeLinkNode(_InodeNode):
+    __slots__ = ('link', 'link_mode')
+
+
+def new_node(name, st, inodes=False):
+    """Return a Node for the entry called name with the lstat (or stat) st.
+
+    Unless inodes is True, only dirs get blocks, dev, ino and nlink.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        node = _InodeLinkNode(name, st) if inodes else _LinkNode(name, st)
+        node.link = None
+        node.link_mode = 0
+        return node
+    if inodes or stat.S_ISDIR(st.st_mode):
+        return _InodeNode(name, st)
+    return Node(name, st)
+
+
+def _list_dir(path, hidden=False):
+    #Yield (name, lstat) for every entry in path. Hidden ones are skipped unless hidden is True
+    if scandir is not None:
+        for entry in scandir(path):
+            if hidden or not entry.name.startswith('.'):
+                yield entry.name, entry.stat(follow_symlinks=False)
+    else:
+        for name in os.listdir(path):
+            if hidden or not name.startswith('.'):
+                yield name, os.lstat(os.path.join(path, name))
+
+
+def _read_dir(path, names=None, hidden=False, inodes=False):
+    #Return a sorted list of Nodes for the contents of path. If the (already sorted)
+    #names in path are known from the scan cache, only stat them instead of reading the dir
+    if names is not None:
+        try:
+            entries = [(name, os.lstat(os.path.join(path, name))) for name in names]
+        except OSError:
+            return _read_dir(path, hidden=hidden, inodes=inodes)   # Something was removed since the cache was saved
+    else:
+        entries = _list_dir(path, hidden)
+
+    nodes = []
+    for name, st in entries:
+        node = new_node(name, st, inodes)
+        if stat.S_ISLNK(st.st_mode):
+            full_path = os.path.join(path, name)
+            try:
+                node.link = os.readlink(full_path)
+                node.link_mode = os.stat(full_path).st_mode
+            except OSError:
+                pass    # Broken link - tree shows it without a type suffix
+        nodes.append(node)
+    if names is None:
+        nodes.sort(key=lambda n: locale.strxfrm(n.name))
+    return nodes
+
+
+def scan_tree(path, old_cache=None, new_cache=None, hidden=False, stats=None, inodes=False):
+    """Walk path once, and return its root Node with all dir sizes filled in.
+
+    old_cache is a scan cache from an earlier walk (see load_cache). Dirs
+    that still have the same inode and mtime are not read again - only their
+    entries are. That is as far as the cache can go, since writing to a file
+    does not change the mtime of the dir it is in. If new_cache is a dict,
+    it gets filled in with the cache for this walk.
+
+    Hidden files and dirs are only walked if hidden is True (du_lines needs
+    them, tree doesn't). They never count towards the size of a dir. Files
+    only get inodes (see new_node) if inodes is True, which du_lines and
+    hash_files need.
+
+    If stats is a dict, the number of entries found and the bytes they add
+    up to go into it, as 'entries' and 'bytes'.
+    """
+    started = time.time()
+    root = new_node(path, os.stat(path), inodes)
+    pending = [(root, path)]
+    dirs = []
+    while pending:
+        node, node_path = pending.pop()
+        dirs.append(node)
+        names = None
+        if old_cache:
+            cached = old_cache.get(node_path)
+            if cached and cached[0] == node.ino and cached[1] == node.mtime and (cached[3] or not hidden):
+                names = [name for name in cached[2] if hidden or not name.startswith('.')]
+        try:
+            node.children = _read_dir(node_path, names, hidden, inodes)
+        except OSError as e:
+            node.error = e.strerror
+            continue
+        #Like git's racy index entries: a dir changed in the same second as the walk could change again unnoticed
+        if new_cache is not None and node.mtime < started - 1:
+            new_cache[node_path] = (node.ino, node.mtime, [child.name for child in node.children], hidden)
+        if stats is not None:
+            stats['entries'] = stats.get('entries', 0) + len(node.children)
+            stats['bytes'] = stats.get('bytes', 0) + sum(child.size for child in node.children)
+        for child in node.children:
+            if child.children is not None:
+                pending.append((child, os.path.join(node_path, child.name)))
+
+    #Every dir comes after its parent in dirs, so walking it backwards adds up sizes bottom-up
+    for node in reversed(dirs):
+        for child in node.children:
+            if not child.name.startswith('.'):
+                node.size += child.size
+    return root
+
+
+def du_lines(root, path):
+    """Return what 'du -hcs' on every entry in path (hidden ones too) would print, from its scanned root.
+
+    Disk usage is counted once per inode, so hard links to the same file
+    only count towards the first entry they show up in.
+    """
+    seen = set()
+    lines = []
+    total = 0
+    for child in root.children:
+        if child.nlink > 1 and child.children is None and (child.dev, child.ino) in seen:
+            continue    # du doesn't list hard links it has already counted at all
+        usage = 0
+        pending = [(child, path.rstrip('/') + '/' + child.name)]
+        while pending:
+            node, node_path = pending.pop()
+            if node.nlink > 1 and node.children is None:
+                if (node.dev, node.ino) in seen:
+                    continue
+                seen.add((node.dev, node.ino))
+            usage += node.blocks
+            if node.error:
+                lines.append("du: cannot read directory '%s': %s" % (node_path, node.error))
+            elif node.children:
+                pending.extend((grandchild, node_path + '/' + grandchild.name) for grandchild in node.children)
+        lines.append('%s\t%s' % (du_size(usage), path.rstrip('/') + '/' + child.name))
+        total += usage
+    lines.append('%s\ttotal' % du_size(total))
+    return '\n'.join(lines) + '\n'
+
+
+#Bumped whenever what load_cache returns changes, so old caches get ignored instead of misread
+_CACHE_VERSION = 4
+
+
+def cache_path(cache_dir, src, suffix='.cache'):
+    #Every source folder gets its own cache file in cache_dir (and its own hash cache file, with another suffix)
+    return os.path.join(cache_dir, hashlib.md5(os.path.abspath(src)).hexdigest() + suffix)
+
+
+def load_cache(path, tag=None):
+    """Return the scan cache saved in path, or an empty one if it's missing or unreadable.
+
+    An empty one is also returned if it wasn't saved with the same tag.
+    """
+    try:
+        with open(path, 'rb') as f:
+            version, saved_tag, cache = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    return cache if version == _CACHE_VERSION and saved_tag == tag else {}
+
+
+def save_cache(path, cache, tag=None):
+    #Write to a temp file first, so a killed run never leaves a broken cache behind
+    with open(path + '.tmp', 'wb') as f:
+        marshal.dump((_CACHE_VERSION, tag, cache), f)
+    os.rename(path + '.tmp', path)
+
+
+def _collate_tag():
+    #The names in the scan cache are sorted for LC_COLLATE, and cron and a shell often have different ones
+    return locale.setlocale(locale.LC_COLLATE)
+
+
+def quick_check_path(cache_dir, argv):
+    #Runs with different arguments (or from a different dir) get different --quick-check state files
+    return os.path.join(cache_dir, hashlib.md5('\0'.join([os.getcwd()] + argv)).hexdigest() + '.state')
+
+
+def file_stamps(paths):
+    """Return [(path, inode, size, mtime)] for every one of paths, for --quick-check to compare with the last run.
+
+    Paths that are missing get None for everything but the path.
+    """
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            stamps.append((path, None, None, None))
+            continue
+        stamps.append((path, st.st_ino, st.st_size, st.st_mtime))
+    return stamps
+
+
+def human_size(size):
+    #Same format as 'tree -h': 4 digit bytes, or 1 decimal place below 10 of a unit
+    if size < 1024:
+        return '%4d' % size
+    idx = 1
+    while size >= 1024 * 1024:
+        idx += 1
+        size //= 1024
+    return ('%3.0f%s' if size // 1024 >= 10 else '%3.1f%s') % (size / 1024.0, 'BKMGTPEZY'[idx])
+
+
+#Names that are nothing but printable ASCII (nearly all of them) look the same in every locale
+_PRINTABLE_ASCII = re.compile(r'^[\x20-\x7e]*$')
+_libc = None
+
+
+def du_size(size):
+    #Same format as 'du -h': no decimal places for bytes, and always rounded up
+    if size < 1024:
+        return str(size)
+    exponent = 1
+    while size >= 1024 ** (exponent + 1):
+        exponent += 1
+    unit = 1024 ** exponent
+    if size // unit < 10:
+        tenths = -(-size * 10 // unit)
+        if tenths < 100:
+            return '%d.%d%s' % (tenths // 10, tenths % 10, 'KMGTPEZY'[exponent - 1])
+        return '10%s' % 'KMGTPEZY'[exponent - 1]
+    amount = -(-size // unit)
+    if amount == 1024 and exponent < 8:
+        return '1.0%s' % 'KMGTPEZY'[exponent]
+    return '%d%s' % (amount, 'KMGTPEZY'[exponent - 1])
+
+
+def _c_library():
+    #The C library, which is what tells tree which characters are printable in the current locale
+    global _libc
+    if _libc is None:
+        import ctypes
+        libc = ctypes.CDLL(None)
+        libc.__ctype_get_mb_cur_max.restype = ctypes.c_size_t
+        _libc = libc
+    return _libc
+
+
+def _tree_escape(name):
+    #Like tree's printit: in a multibyte LC_CTYPE (like UTF-8), characters that aren't printable are written as
+    #a backslash-octal escape of their code. Names that aren't valid in it, and every name in a single byte
+    #LC_CTYPE (like the C locale cron runs with), get that for every byte that isn't printable
+    if _PRINTABLE_ASCII.match(name):
+        return name
+    libc = _c_library()
+    if libc.__ctype_get_mb_cur_max() > 1:
+        codeset = locale.nl_langinfo(locale.CODESET)
+        try:
+            chars = name.decode(codeset)
+        except (UnicodeDecodeError, LookupError):
+            pass
+        else:
+            return ''.join(char.encode(codeset) if libc.iswprint(ord(char)) else '\\%03o' % ord(char)
+                           for char in chars)
+    return ''.join(char if libc.isprint(ord(char)) else '\\%03o' % ord(char) for char in name)
+
+
+def _type_suffix(mode):
+    #The suffix 'tree -F' adds after a name
+    if stat.S_ISDIR(mode):
+        return '/'
+    if stat.S_ISSOCK(mode):
+        return '='
+    if stat.S_ISFIFO(mode):
+        return '|'
+    if stat.S_ISREG(mode) and mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+        return '*'
+    return ''
+
+
+def _tree_name(node):
+    if node.link is None:
+        name = _tree_escape(node.name) + _type_suffix(node.mode)
+    else:
+        name = '%s -> %s%s' % (_tree_escape(node.name), _tree_escape(node.link), _type_suffix(node.link_mode))
+    if node.error:
+        name += ' [error opening dir]'
+    return name
+
+
+def _visible(nodes):
+    return [node for node in nodes if not node.name.startswith('.')]
+
+
+def write_tree(out, root, drop=False):
+    """Write root to out, line by line, exactly like 'tree --du -h --charset -F' would.
+
+    If drop is True, every dir lets go of its entries once they are on their
+    way out, so the memory they take is freed as the tree gets written. root
+    has no entries left after that.
+    """
+    out.write(_tree_escape(root.name) + (' [error opening dir]\n' if root.error else '\n'))
+    dir_count = 0
+    file_count = 0
+    pending = [(_visible(root.children), 0, '')]
+    if drop:
+        root.children = []
+    while pending:
+        children, i, prefix = pending.pop()
+        if i == len(children):
+            continue
+        node = children[i]
+        last = i == len(children) - 1
+        pending.append((children, i + 1, prefix))
+        out.write('%s%s[%s]  %s\n' % (prefix, '`-- ' if last else '|-- ', human_size(node.size), _tree_name(node)))
+        if node.is_dir():
+            dir_count += 1
+        else:
+            file_count += 1
+        if node.children:
+            pending.append((_visible(node.children), 0, prefix + ('    ' if last else '|   ')))
+            if drop:
+                node.children = []
+    out.write('\n %s used in %d director%s, %d file%s\n' % (human_size(root.size),
+                                                            dir_count, 'y' if dir_count == 1 else 'ies',
+                                                            file_count, '' if file_count == 1 else 's'))
+
+
+def hash_file(path):
+    """Return the hex SHA-1 digest of what's in the file at path, or None if it can't be read.
+
+    The file is read a block at a time, so big files don't need the memory.
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), ''):
+                digest.update(block)
+    except (OSError, IOError):
+        return None
+    return digest.hexdigest()
+
+
+def hash_files(root, src, cache=None, max_jobs=1, stats=None):
+    """Return (hashes, new_cache) for every file in the listing of the scanned root of src.
+
+    hashes is a list of (path relative to src, size, digest), in the same
+    order as the listing, without the files that couldn't be read. cache is
+    a dict of (mount, inode, size, mtime) -> digest from an earlier call (or
+    the hash cache file, see load_cache), and files that are in it are not
+    read again, and neither are hard links to a file that was already read.
+    mount is the path in src of the filesystem mounted in it that the file is
+    on ('' for the one src is on). Device numbers of network filesystems
+    change every time they are mounted, so they are only used to find hard
+    links. Up to max_jobs files are read at the same time. new_cache is the
+    cache to use next time.
+
+    If stats is a dict, the number of files that were read and the bytes in
+    them go into it, as 'hashed_files' and 'hashed_bytes'.
+    """
+    started = time.time()
+    cache = cache or {}
+    files = []
+    pending = [(node, node.name, root, '') for node in reversed(_visible(root.children))]
+    while pending:
+        node, path, parent, mount = pending.pop()
+        if node.children is not None:
+            if node.dev != parent.dev:
+                mount = path
+            pending.extend((child, path + '/' + child.name, node, mount)
+                           for child in reversed(_visible(node.children)))
+        elif stat.S_ISREG(node.mode):
+            files.append((path, node, (mount, node.ino, node.size, node.mtime)))
+
+    #Keyed by the device instead of the mount, so hard links are read once
+    to_read = {}
+    for path, node, key in files:
+        link_key = (node.dev, node.ino, node.size, node.mtime)
+        if key not in cache and link_key not in to_read:
+            to_read[link_key] = os.path.join(src, path)
+    link_keys = list(to_read)
+    read = dict(zip(link_keys, run_jobs([(None, hash_file, (to_read[link_key],)) for link_key in link_keys],
+                                        max_jobs, max_jobs)))
+    if stats is not None:
+        stats['hashed_files'] = len(link_keys)
+        stats['hashed_bytes'] = sum(link_key[2] for link_key in link_keys)
+
+    hashes = []
+    new_cache = {}
+    for path, node, key in files:
+        digest = cache[key] if key in cache else read[(node.dev, node.ino, node.size, node.mtime)]
+        if digest is None:
+            continue
+        hashes.append((path, node.size, digest))
+        #Same as the scan cache: a file changed in the same second it was read could change again unnoticed
+        if node.mtime < started - 1:
+            new_cache[key] = digest
+    return hashes, new_cache
+
+
+def write_hashes(out, hashes):
+    """Write hashes (see hash_files) to out like sha1sum does, so 'sha1sum -c' can check them in the source folder."""
+    for path, size, digest in hashes:
+        if '\\' in path or '\n' in path:
+            out.write('\\%s  %s\n' % (digest, path.replace('\\', '\\\\').replace('\n', '\\n')))
+        else:
+            out.write('%s  %s\n' % (digest, path))
+
+
+def write_hash_report(out, groups):
+    """Write every file that nothing in any other group has the same content as to out, group by group.
+
+    groups is a list of (name, [(source folder, hashes)]), with hashes from
+    hash_files. Empty files are left out - there's nothing in them to lose.
+    """
+    #Digest -> the index of the only group that has it, or -1 if more than one does
+    owners = {}
+    for n, (name, sources) in enumerate(groups):
+        for src, hashes in sources:
+            for path, size, digest in hashes:
+                if owners.setdefault(digest, n) != n:
+                    owners[digest] = -1
+
+    for n, (name, sources) in enumerate(groups):
+        out.write(name + '\n' + '=' * len(name) + '\n')
+        count = 0
+        total = 0
+        for src, hashes in sources:
+            for path, size, digest in hashes:
+                if size and owners[digest] == n:
+                    out.write('[%s]  %s\n' % (human_size(size), _tree_escape(src.rstrip('/') + '/' + path)))
+                    count += 1
+                    total += size
+        out.write('\n %s in %d file%s only in %s\n\n' % (human_size(total), count, '' if count == 1 else 's', name))
+
+
+#Snapshot files start with _SNAPSHOT_MAGIC, then a _SNAPSHOT_HEADER of entry count, name count and names size.
+#Then come the columns: parent index, name index, mode, size and mtime of every entry, the offsets of
+#every name (plus the end of the last one) and finally all the names. Entry 0 is the source folder
+#itself, and the rest are in depth first order, with every dir's entries sorted by name.
+_SNAPSHOT_MAGIC = 'TCSNAP\x01\x00'
+_SNAPSHOT_HEADER = struct.Struct('<QQQ')
+_SNAPSHOT_COLUMNS = ('i', 'I', 'I', 'Q', 'q')
+
+
+def write_snapshot(out, root):
+    """Write root to out as a snapshot file, for 'diff'. Hidden entries are left out, like in the listing."""
+    names = {}
+    columns = ([], [], [], [], [])
+    pending = [(root, -1)]
+    while pending:
+        node, parent = pending.pop()
+        index = len(columns[0])
+        for column, value in zip(columns, (parent, names.setdefault(node.name, len(names)), node.mode,
+                                           node.size, int(node.mtime))):
+            column.append(value)
+        if node.children:
+            #Pushed backwards, so they come off the stack sorted
+            pending.extend((child, index) for child in sorted(_visible(node.children),
+                                                               key=lambda n: n.name, reverse=True))
+
+    name_list = sorted(names, key=names.get)
+    offsets = [0]
+    for name in name_list:
+        offsets.append(offsets[-1] + len(name))
+
+    out.write(_SNAPSHOT_MAGIC)
+    out.write(_SNAPSHOT_HEADER.pack(len(columns[0]), len(name_list), offsets[-1]))
+    for column, code in zip(columns + (offsets,), _SNAPSHOT_COLUMNS + ('Q',)):
+        for start in range(0, len(column), 65536):
+            chunk = column[start:start + 65536]
+            out.write(struct.pack('<%d%s' % (len(chunk), code), *chunk))
+    for name in name_list:
+        out.write(name)
+
+
+class Snapshot(object):
+    """A snapshot file, memory mapped, so that only the parts that get used are ever read."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+            raise ValueError("'%s' is not a snapshot" % path)
+        self.count, name_count, names_size = _SNAPSHOT_HEADER.unpack_from(self.map, len(_SNAPSHOT_MAGIC))
+        offset = len(_SNAPSHOT_MAGIC) + _SNAPSHOT_HEADER.size
+        self.columns = []
+        for code, count in zip(_SNAPSHOT_COLUMNS + ('Q',), (self.count,) * 5 + (name_count + 1,)):
+            self.columns.append((offset, struct.Struct('<' + code)))
+            offset += count * struct.calcsize('<' + code)
+        self.names = offset
+        if offset + names_size != len(self.map):
+            raise ValueError("'%s' is not a snapshot" % path)
+
+    def _get(self, column, index):
+        offset, item = self.columns[column]
+        return item.unpack_from(self.map, offset + index * item.size)[0]
+
+    def name(self, index):
+        name_index = self._get(1, index)
+        return self.map[self.names + self._get(5, name_index):self.names + self._get(5, name_index + 1)]
+
+    def entries(self):
+        """Yield (path, mode, size, mtime) for every entry but the root, in order.
+
+        path is a tuple of the names leading to the entry from the root, so
+        comparing paths puts them in the same order they're yielded in.
+        """
+        stack = []  # (index, name) of every dir the current entry is in
+        for index in range(1, self.count):
+            parent = self._get(0, index)
+            while stack and stack[-1][0] != parent:
+                stack.pop()
+            path = tuple(name for dir_index, name in stack) + (self.name(index),)
+            yield path, self._get(2, index), self._get(3, index), self._get(4, index)
+            stack.append((index, path[-1]))
+
+    def close(self):
+        self.map.close()
+
+
+def diff_snapshots(old, new):
+    """Yield a line for every entry that was added, removed or resized between the old and new Snapshots.
+
+    Both snapshots are walked side by side, so it takes next to no memory. The
+    size of a dir changes whenever anything under it does, so only files can
+    show up as resized. An entry that went from a file to a dir, or the other
+    way around, shows up as removed and added again.
+    """
+    old_entries = old.entries()
+    new_entries = new.entries()
+    old_entry = next(old_entries, None)
+    new_entry = next(new_entries, None)
+    while old_entry or new_entry:
+        if new_entry is None or (old_entry is not None and old_entry[0] < new_entry[0]):
+            yield '- [%s]  %s%s\n' % (human_size(old_entry[2]), '/'.join(old_entry[0]),
+                                      '/' if stat.S_ISDIR(old_entry[1]) else '')
+            old_entry = next(old_entries, None)
+        elif old_entry is None or new_entry[0] < old_entry[0]:
+            yield '+ [%s]  %s%s\n' % (human_size(new_entry[2]), '/'.join(new_entry[0]),
+                                      '/' if stat.S_ISDIR(new_entry[1]) else '')
+            new_entry = next(new_entries, None)
+        else:
+            if stat.S_ISDIR(old_entry[1]) != stat.S_ISDIR(new_entry[1]):
+                yield '- [%s]  %s%s\n' % (human_size(old_entry[2]), '/'.join(old_entry[0]),
+                                          '/' if stat.S_ISDIR(old_entry[1]) else '')
+                yield '+ [%s]  %s%s\n' % (human_size(new_entry[2]), '/'.join(new_entry[0]),
+                                          '/' if stat.S_ISDIR(new_entry[1]) else '')
+            elif old_entry[2] != new_entry[2] and not stat.S_ISDIR(new_entry[1]):
+                yield '~ [%s -> %s]  %s\n' % (human_size(old_entry[2]), human_size(new_entry[2]),
+                                              '/'.join(new_entry[0]))
+            old_entry = next(old_entries, None)
+            new_entry = next(new_entries, None)
+
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (id INTEGER PRIMARY KEY, listing TEXT UNIQUE, root TEXT, digest TEXT);
+CREATE TABLE IF NOT EXISTS entries (listing INTEGER, path TEXT, name TEXT, depth INTEGER, size INTEGER,
+                                    is_dir INTEGER);
+CREATE INDEX IF NOT EXISTS entries_listing ON entries (listing);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+CREATE INDEX IF NOT EXISTS entries_depth ON entries (depth);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+"""
+
+#sqlite only lets one connection write at a time, so the jobs take turns
+_index_lock = threading.Lock()
+
+
+def open_index(path):
+    """Open (and create, if needed) the query index at path."""
+    import sqlite3
+    connection = sqlite3.connect(path, timeout=60)
+    connection.text_factory = str
+    connection.executescript(_INDEX_SCHEMA)
+    #Indexes from before listings had a digest get one, which no listing matches until it's been indexed again
+    if 'digest' not in [column[1] for column in connection.execute('PRAGMA table_info(listings)')]:
+        connection.execute('ALTER TABLE listings ADD COLUMN digest TEXT')
+    return connection
+
+
+def _index_rows(listing_id, root):
+    #Yield a row of the entries table for everything in the listing of root. Paths start
+    #with the name of the listing, just like the 'which' query expects them to
+    pending = [(child, os.path.basename(root.name.rstrip('/')), 1) for child in _visible(root.children)]
+    while pending:
+        node, parent_path, depth = pending.pop()
+        path = parent_path + '/' + node.name
+        yield listing_id, path, node.name, depth, node.size, node.is_dir()
+        if node.children:
+            pending.extend((child, path, depth + 1) for child in _visible(node.children))
+
+
+def index_listing(index_path, listing, root):
+    """Replace whatever the query index at index_path has for listing with the entries of root.
+
+    Nothing happens if the index already has exactly these entries for it.
+    That is worked out from the entries themselves, not the listing, which
+    only has rounded sizes.
+    """
+    listing = os.path.abspath(listing)
+    root_path = os.path.abspath(root.name)
+    digest = hashlib.sha1(root_path)
+    for row in _index_rows(None, root):
+        digest.update('\0%s\0%d\0%d' % (row[1], row[4], row[5]))
+    digest = digest.hexdigest()
+    with _index_lock:
+        connection = open_index(index_path)
+        try:
+            with connection:
+                row = connection.execute('SELECT id, digest FROM listings WHERE listing = ?', (listing,)).fetchone()
+                if row and row[1] == digest:
+                    return
+                if row:
+                    listing_id = row[0]
+                    connection.execute('DELETE FROM entries WHERE listing = ?', (listing_id,))
+                    connection.execute('UPDATE listings SET root = ?, digest = ? WHERE id = ?',
+                                       (root_path, digest, listing_id))
+                else:
+                    listing_id = connection.execute('INSERT INTO listings (listing, root, digest) VALUES (?, ?, ?)',
+                                                    (listing, root_path, digest)).lastrowid
+                connection.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                                       _index_rows(listing_id, root))
+        finally:
+            connection.close()
+
+
+def query_index(connection, depth=None, largest=None, name=None, which=None, under=None):
+    """Yield a line for every entry in the query index that matches.
+
+    depth, name (a glob) and under (a path in the listings, or an absolute
+    path in the source folders) narrow down the entries. largest only gives
+    the K biggest ones. which gives every listing a path is in.
+    """
+    where = []
+    params = []
+    for path, exact in ((under, False), (which, True)):
+        if path is None:
+            continue
+        path = path.rstrip('/')
+        if path.startswith('/'):
+            #Turn a path in a source folder into one in its listing. Roots are absolute, but
+            #indexes from before that have them the way they were given, so make sure
+            path = os.path.abspath(path)
+            for root, in connection.execute('SELECT DISTINCT root FROM listings'):
+                root = os.path.abspath(root).rstrip('/')
+                if path == root or path.startswith(root + '/'):
+                    path = os.path.basename(root) + path[len(root):]
+                    break
+        if exact:
+            where.append('path = ?')
+            params.append(path)
+        else:
+            #Everything that starts with 'path/' ('0' comes right after '/')
+            where.append('path > ? AND path < ?')
+            params.extend((path + '/', path + '0'))
+    if depth is not None:
+        where.append('depth = ?')
+        params.append(depth)
+    if name is not None:
+        where.append('name GLOB ?')
+        params.append(name)
+
+    sql = 'SELECT listings.listing, path, size, is_dir FROM entries JOIN listings ON entries.listing = listings.id'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if largest is not None:
+        sql += ' ORDER BY size DESC LIMIT ?'
+        params.append(largest)
+    else:
+        sql += ' ORDER BY listings.listing, path'
+    for listing, path, size, is_dir in connection.execute(sql, params):
+        yield '[%s]  %s: %s%s\n' % (human_size(size), listing, path, '/' if is_dir else '')
+
+
+class ConfigError(Exception):
+    """Raised by load_config when the config file isn't valid. The message is shown to the user as is."""
+
+
+#Options a config file can set, for when they aren't given on the command line, by the type they have to be
+_CONFIG_FLAGS = ('full_rescan', 'hash', 'ignore')
+_CONFIG_COUNTS = ('hash_jobs', 'jobs', 'mount_jobs')
+_CONFIG_NUMBERS = ('git_gc', 'mount_timeout', 'quick_check', 'watch', 'watch_commit', 'watch_rescan')
+_CONFIG_PATHS = ('cache', 'git', 'hash_report', 'index', 'snapshot', 'stats')
+CONFIG_OPTIONS = _CONFIG_FLAGS + _CONFIG_COUNTS + _CONFIG_NUMBERS + _CONFIG_PATHS
+
+
+def _to_str(value):
+    #json gives back unicode, but paths are str everywhere else
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_to_str(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_to_str(key), _to_str(item)) for key, item in value.items())
+    return value
+
+
+def _config_list(config, key, where):
+    value = config.get(key, [])
+    if not isinstance(value, list):
+        raise ConfigError("'%s' in %s must be a list" % (key, where))
+    for item in value:
+        if not isinstance(item, dict):
+            raise ConfigError("everything in '%s' in %s must be an object" % (key, where))
+    return value
+
+
+def _config_keys(entry, keys, where):
+    unknown = set(entry) - set(keys)
+    if unknown:
+        raise ConfigError("%s has unknown settings: %s" % (where, ', '.join(sorted(unknown))))
+
+
+def _config_path(value, what, where):
+    if not isinstance(value, str) or not value:
+        raise ConfigError("%s in %s must be a path" % (what, where))
+    return value
+
+
+def _config_sources(entry, where, ignore_sources):
+    #Check the 'sources' of an entry, and return their paths
+    sources = entry.get('sources')
+    if not isinstance(sources, list) or not sources:
+        raise ConfigError("'sources' in %s must be a list of at least 1 source folder" % where)
+    paths = []
+    for source in sources:
+        if isinstance(source, dict):
+            if set(source) - set(['path', 'ignore']):
+                raise ConfigError("a source in %s can only have a 'path' and 'ignore'" % where)
+            paths.append(_config_path(source.get('path'), "every source's 'path'", where))
+            if source.get('ignore'):
+                ignore_sources.add(paths[-1])
+        else:
+            paths.append(_config_path(source, 'every source', where))
+    return paths
+
+
+def load_config(path):
+    """Read and check the JSON config file at path.
+
+    Returns (folders, totals, groups, options, ignore_sources). folders and
+    totals are lists like the ones -f and -t give. groups has a list of
+    (group name, number of sources) for each of totals, or None if it has no
+    groups. options has the CONFIG_OPTIONS the file sets, and ignore_sources
+    the source folders that are treated as if -i was given just for them.
+    """
+    import json
+    try:
+        with open(path) as f:
+            config = _to_str(json.load(f))
+    except IOError:
+        raise ConfigError("failed to read the config file '%s'" % path)
+    except ValueError as e:
+        raise ConfigError("'%s' is not valid JSON: %s" % (path, e))
+    if not isinstance(config, dict):
+        raise ConfigError("'%s' must have a JSON object in it" % path)
+
+    unknown = set(config) - set(CONFIG_OPTIONS + ('folders', 'totals'))
+    if unknown:
+        raise ConfigError("'%s' has unknown settings: %s" % (path, ', '.join(sorted(unknown))))
+    for key in CONFIG_OPTIONS:
+        if key not in config:
+            continue
+        value = config[key]
+        #bool is an int too, so it has to be ruled out for the numbers
+        if key in _CONFIG_FLAGS and not isinstance(value, bool):
+            raise ConfigError("'%s' in %s must be true or false" % (key, path))
+        if key in _CONFIG_COUNTS and (isinstance(value, bool) or not isinstance(value, (int, long))):
+            raise ConfigError("'%s' in %s must be a whole number" % (key, path))
+        if key in _CONFIG_NUMBERS and (isinstance(value, bool) or not isinstance(value, (int, long, float))):
+            raise ConfigError("'%s' in %s must be a number" % (key, path))
+        if key in _CONFIG_PATHS:
+            _config_path(value, "'%s'" % key, path)
+
+    folders = []
+    totals = []
+    groups = []
+    ignore_sources = set()
+    for n, entry in enumerate(_config_list(config, 'folders', path)):
+        where = "'folders' entry %d" % (n + 1)
+        _config_keys(entry, ('output', 'sources'), where)
+        folders.append([_config_path(entry.get('output'), "'output'", where)] +
+                       _config_sources(entry, where, ignore_sources))
+    for n, entry in enumerate(_config_list(config, 'totals', path)):
+        where = "'totals' entry %d" % (n + 1)
+        _config_keys(entry, ('output', 'groups', 'sources'), where)
+        totals.append([_config_path(entry.get('output'), "'output'", where)])
+        if 'groups' in entry:
+            if 'sources' in entry:
+                raise ConfigError("%s can have 'groups' or 'sources', but not both" % where)
+            groups.append([])
+            for group in _config_list(entry, 'groups', where):
+                name = group.get('name')
+                if not isinstance(name, str) or not name:
+                    raise ConfigError("every group in %s must have a 'name'" % where)
+                _config_keys(group, ('name', 'sources'), "group '%s' of %s" % (name, where))
+                group_sources = _config_sources(group, "group '%s' of %s" % (name, where), ignore_sources)
+                groups[-1].append((name, len(group_sources)))
+                totals[-1] += group_sources
+            if len(totals[-1]) == 1:
+                raise ConfigError("'groups' in %s must have at least 1 group" % where)
+        else:
+            groups.append(None)
+            totals[-1] += _config_sources(entry, where, ignore_sources)
+
+    return folders, totals, groups, dict((key, config[key]) for key in CONFIG_OPTIONS if key in config), \
+        ignore_sources
+
+
+class OutputFile(object):
+    """A file that is written to a temp file next to path, and then renamed over it.
+
+    Nothing ever sees a half written output file that way. If the new content
+    is the same as what path already has, path is left alone (mtime and all),
+    and changed is False after close(). Otherwise, if backup_path is given,
+    the old path is kept there.
+    """
+
+    def __init__(self, path, backup_path=None):
+        self.path = path
+        self.backup_path = backup_path
+        self.changed = None
+        fd, self.temp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), suffix='.tmp',
+                                              dir=os.path.dirname(path) or '.')
+        self.file = os.fdopen(fd, 'w')
+        self.hash = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def _same_as_existing(self):
+        try:
+            if os.path.getsize(self.path) != self.size:
+                return False
+            existing = hashlib.sha1()
+            with open(self.path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), ''):
+                    existing.update(block)
+        except (OSError, IOError):
+            return False
+        return existing.digest() == self.hash.digest()
+
+    def close(self):
+        self.file.close()
+        if self._same_as_existing():
+            os.remove(self.temp_path)
+            self.changed = False
+        else:
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except OSError:
+                mode = 0666 & ~_get_umask()
+            os.chmod(self.temp_path, mode)
+            if self.backup_path and os.path.exists(self.path):
+                #A hard link instead of a rename, so there's never a moment without anything at path
+                try:
+                    os.remove(self.backup_path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                os.link(self.path, self.backup_path)
+            os.rename(self.temp_path, self.path)
+            self.changed = True
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class JobError(Exception):
+    """Raised by a job when it fails. The message is shown to the user as is."""
+
+
+#Filesystem types that can hang when the server behind them goes away
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', 'ceph', 'glusterfs', '9p',
+                       'fuse.sshfs')
+
+
+def read_mounts(mountinfo='/proc/self/mountinfo'):
+    """Return {mount point: filesystem type} for everything that is mounted, or {} if that can't be told."""
+    mounts = {}
+    try:
+        with open(mountinfo) as f:
+            for line in f:
+                fields = line.split()
+                #The mount point is field 5, and the type comes right after the '-' that ends the optional fields
+                mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[4])
+                mounts[mount_point] = fields[fields.index('-', 6) + 1]
+    except (IOError, IndexError, ValueError):
+        return {}
+    return mounts
+
+
+def _filesystem_type(path, mounts):
+    #The type of the filesystem path is on, going by the longest mount point it's under. No syscalls, so it can't hang
+    path = os.path.abspath(path)
+    while True:
+        if path in mounts:
+            return mounts[path]
+        if path == '/':
+            return None
+        path = os.path.dirname(path)
+
+
+def _on_network_filesystem(path, mounts):
+    filesystem = _filesystem_type(path, mounts)
+    return bool(filesystem) and filesystem.split('.')[0] in [fs.split('.')[0] for fs in NETWORK_FILESYSTEMS]
+
+
+def check_source(path, mounts):
+    """Return (state, st_dev) for the source folder path.
+
+    state is 'missing' if it isn't a dir, 'empty' if it's an empty dir that
+    isn't a mount point (like an NFS mount point when nothing is mounted on
+    it), and 'ok' otherwise - including for a mounted share that's empty.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing', None
+    if not stat.S_ISDIR(st.st_mode):
+        return 'missing', None
+    if os.path.realpath(path) in mounts:
+        return 'ok', st.st_dev
+    try:
+        if scandir is not None:
+            #Only read as far as the first entry
+            for entry in scandir(path):
+                return 'ok', st.st_dev
+            return 'empty', st.st_dev
+        return ('ok' if os.listdir(path) else 'empty'), st.st_dev
+    except OSError:
+        return 'ok', st.st_dev     # Can't be read - let walking it report that
+
+
+def check_sources(paths, timeout):
+    """Return {path: (state, st_dev)} (see check_source) for every one of paths.
+
+    /proc/self/mountinfo is read once. Every path is checked on its own
+    thread, all at the same time, and the ones that don't answer within
+    timeout seconds (a hung mount) get a state of 'hung'. Which filesystem a
+    path is on can't be told without following symlinks in it, which can
+    hang too, so local paths get a thread as well.
+    """
+    mounts = read_mounts()
+    states = {}
+    threads = []
+    for path in set(paths):
+        thread = threading.Thread(target=lambda p=path: states.__setitem__(p, check_source(p, mounts)))
+        thread.daemon = True    # A thread stuck on a dead mount must not keep us from exiting
+        thread.start()
+        threads.append((path, thread))
+
+    deadline = time.time() + timeout
+    for path, thread in threads:
+        while thread.is_alive() and time.time() < deadline:
+            thread.join(min(0.5, max(deadline - time.time(), 0)))
+        if path not in states:
+            states[path] = ('hung', None)
+    return states
+
+
+def run_jobs(jobs, max_jobs=1, mount_jobs=1):
+    """Run every job, and return a list of their results in the same order as jobs.
+
+    Each job is a (key, function, args) tuple. At most max_jobs jobs run at
+    once, and at most mount_jobs of the ones that have the same key. If a job
+    fails, no new jobs are started, and the error of the first failed job is
+    raised once the running ones are done.
+    """
+    if max_jobs <= 1:
+        return [function(*job_args) for key, function, job_args in jobs]
+
+    results = [None] * len(jobs)
+    errors = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    running = {}
+    cond = threading.Condition()
+
+    def next_job():
+        #Called with cond held. Returns the index of the next job that can run, or None if there are none left
+        while pending and not any(errors):
+            for n, index in enumerate(pending):
+                if running.get(jobs[index][0], 0) < mount_jobs:
+                    del pending[n]
+                    running[jobs[index][0]] = running.get(jobs[index][0], 0) + 1
+                    return index
+            cond.wait()
+        return None
+
+    def worker():
+        while True:
+            with cond:
+                index = next_job()
+            if index is None:
+                return
+            key, function, job_args = jobs[index]
+            try:
+                results[index] = function(*job_args)
+            except Exception:
+                errors[index] = sys.exc_info()
+            with cond:
+                running[key] -= 1
+                cond.notify_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(min(max_jobs, len(jobs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        #Join with a timeout, so that Ctrl+C still works while waiting
+        while thread.is_alive():
+            thread.join(0.5)
+
+    for error in errors:
+        if error:
+            raise error[0], error[1], error[2]
+    return results
+
+
+def write_outputs(root, src, out_paths, totals, snapshot_path=None, index_path=None, stats=None, hashes=None,
+                  drop=False):
+    """Write everything that comes from the scanned root of src: its listings, snapshot and index entries.
+
+    See scan_source for what each argument is for. If hashes (see
+    hash_files) is given, they are written next to every listing, with
+    '.sha1' added to its name. Returns du_lines if totals is True, and None
+    otherwise. If stats is a dict, the bytes written are added to its
+    'output_bytes'. Raises JobError if anything fails.
+
+    If drop is True, root is not needed after this, and its entries are let
+    go of while the last listing is written (see write_tree).
+    """
+    #sqlite3 takes a while to import, so only runs with --index do
+    index_error = ()
+    if index_path:
+        import sqlite3
+        index_error = sqlite3.Error
+    if stats is None:
+        stats = {}
+    #Everything else that needs root goes first, so the last listing can drop it
+    sizes = du_lines(root, src) if totals else None
+    if snapshot_path:
+        try:
+            with OutputFile(snapshot_path, snapshot_path + '.prev') as f:
+                write_snapshot(f, root)
+            stats['output_bytes'] = stats.get('output_bytes', 0) + f.size
+        except (OSError, IOError):
+            raise JobError("failed to save the snapshot of '%s' to '%s'" % (src, snapshot_path))
+
+    try:
+        for n, out_path in enumerate(out_paths):
+            with OutputFile(out_path) as f:
+                write_tree(f, root, drop and not index_path and n == len(out_paths) - 1)
+            stats['output_bytes'] = stats.get('output_bytes', 0) + f.size
+            if index_path:
+                index_listing(index_path, out_path, root)
+            if hashes is not None:
+                with OutputFile(out_path + '.sha1') as f:
+                    write_hashes(f, hashes)
+                stats['output_bytes'] += f.size
+    except (OSError, IOError):
+        raise JobError("failed to list '%s'" % src)
+    except index_error:
+        raise JobError("failed to add '%s' to the query index '%s'" % (src, index_path))
+    return sizes
+
+
+def scan_source(src, out_paths, totals, cache_dir=None, full_rescan=False, snapshot_path=None, index_path=None,
+                keep_root=False, hash_jobs=0):
+    """The job behind every source folder, whether it's for -f, -t or both, so it only gets walked once.
+
+    Writes the tree listing of src to every one of out_paths, and if totals
+    is True, returns its du_lines for -t. If snapshot_path is given, a
+    snapshot of src is saved there, and the one it replaces gets '.prev'
+    added to its name. If index_path is given, the query index there
+    is updated for every listing with entries that changed. If hash_jobs is more than 0,
+    the files in the listing are hashed on that many threads (see
+    hash_files), and the hashes are written next to it. The hash cache in
+    cache_dir is used for that too, unless full_rescan is True.
+
+    Returns (du_lines or None, stats, root, hashes, hash_cache), where stats
+    is a dict for --stats, and hashes is the list from hash_files, or None if
+    nothing was hashed. root is the scanned root Node, and hash_cache the
+    cache for the next hash_files, if keep_root is True (for --watch), and
+    None otherwise. Without keep_root, the tree is let go of as it gets
+    written.
+    """
+    started = time.time()
+    stats = {'source': src, 'entries': 0, 'bytes': 0, 'output_bytes': 0}
+    hashing = bool(hash_jobs and out_paths)
+    try:
+        if cache_dir:
+            new_cache = {}
+            old_cache = None if full_rescan else load_cache(cache_path(cache_dir, src), _collate_tag())
+            root = scan_tree(src, old_cache, new_cache, hidden=totals, stats=stats, inodes=totals or hashing)
+        else:
+            root = scan_tree(src, hidden=totals, stats=stats, inodes=totals or hashing)
+    except (OSError, IOError):
+        raise JobError("failed to list '%s'" % src)
+
+    hashes = hash_cache = None
+    if hashing:
+        hash_cache_path = cache_dir and cache_path(cache_dir, src, '.hashes')
+        old_hash_cache = load_cache(hash_cache_path) if cache_dir and not full_rescan else None
+        hashes, hash_cache = hash_files(root, src, old_hash_cache, hash_jobs, stats)
+
+    sizes = write_outputs(root, src, out_paths, totals, snapshot_path, index_path, stats, hashes, not keep_root)
+
+    if cache_dir:
+        try:
+            save_cache(cache_path(cache_dir, src), new_cache, _collate_tag())
+            if hash_cache is not None:
+                save_cache(hash_cache_path, hash_cache)
+        except (OSError, IOError):
+            raise JobError("failed to save the scan cache for '%s' to '%s'" % (src, cache_dir))
+
+    stats['seconds'] = time.time() - started
+    stats['entries_per_second'] = stats['entries'] / stats['seconds'] if stats['seconds'] else 0.0
+    if keep_root:
+        return sizes, stats, root, hashes, hash_cache
+    return sizes, stats, None, hashes, None
+
+
+def write_total(out_file, sections, sizes):
+    """Write the -t output file out_file, and return its stats for --stats.
+
+    sections is a list of (source folder, message). The du_lines of the
+    source folder in sizes go under its name, unless there's a message
+    instead. Sections without a source folder are group headers from the
+    config file, and only their message is written.
+    """
+    with OutputFile(out_file) as f:
+        for src, message in sections:
+            if src is None:
+                f.write(message)
+                continue
+            f.write(src + '\n' + '=' * len(src) + '\n')
+            f.write(message or sizes[src])
+            f.write('\n\n')
+    return {'output': out_file, 'output_bytes': f.size}
+
+
+class Inotify(object):
+    """The parts of inotify(7) that Watcher needs, through ctypes, since python 2 has no module for it.
+
+    Raises OSError (or AttributeError if libc has no inotify at all, or
+    ImportError if there's no ctypes) when it can't be set up.
+    """
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_DONT_FOLLOW = 0x2000000
+    IN_EXCL_UNLINK = 0x4000000
+    IN_CLOEXEC = 0x80000
+
+    #Everything that can change a listing, a snapshot or a du line
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+                  IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+    #struct inotify_event, without the name that follows it
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path):
+        """Start watching the dir path, and return its watch descriptor (the same one if it's already watched)."""
+        import ctypes
+        wd = self.libc.inotify_add_watch(self.fd, path, self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        return wd
+
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Return a list of (wd, mask, name) for every event that came in, waiting up to timeout seconds for one."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            events.append((wd, mask, data[offset:offset + length].rstrip('\0')))
+            offset += length
+        return events
+
+
+class Watcher(object):
+    """Keeps the scanned root Nodes of source folders up to date as they change, for --watch.
+
+    Source folders on local filesystems are watched with inotify, and only
+    the dirs that something happened in are read again. The rest - the ones
+    on network filesystems, where inotify never hears about changes made by
+    other machines, and every one of them if inotify can't be used or runs
+    out of watches - are walked again every rescan seconds instead. If the
+    inotify event queue overflows, everything it was watching is walked again.
+
+    roots is {source folder: root Node}, and hidden and inodes are {source
+    folder: whether hidden entries are walked} and {source folder: whether
+    files get inodes} (see scan_tree).
+    """
+
+    def __init__(self, roots, hidden, inodes, rescan):
+        self.roots = {}
+        self.hidden = {}
+        self.inodes = {}
+        self.rescan = rescan
+        self.dirty = {}     # Source folder -> the dirs in it that need to be read again, or None to walk it all again
+        self.watches = {}   # Watch descriptor -> (source folder, dir)
+        self.polled = {}    # Source folder -> when it was last walked, for the ones inotify isn't used for
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError, ImportError):
+            self.inotify = None
+        mounts = read_mounts()
+        for src in roots:
+            self.add(src, roots[src], hidden[src], inodes[src], mounts)
+
+    def add(self, src, root, hidden, inodes, mounts=None):
+        """Start keeping the root Node of another source folder up to date (see the class for the arguments)."""
+        self.roots[src] = root
+        self.hidden[src] = hidden
+        self.inodes[src] = inodes
+        #src was just walked, so following the symlinks in it won't hang
+        if self.inotify is None or _on_network_filesystem(os.path.realpath(src),
+                                                          read_mounts() if mounts is None else mounts):
+            self.polled[src] = time.time()
+        else:
+            self._watch_tree(src, root, src)
+
+    def _watch_tree(self, src, root, path):
+        #Watch every dir in root (which is at path), or fall back to walking src every so often if there are too many
+        pending = [(root, path)]
+        while pending:
+            node, node_path = pending.pop()
+            try:
+                self.watches[self.inotify.add_watch(node_path)] = (src, node_path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    print >> sys.stderr, "%s: warning:" % os.path.basename(sys.argv[0]) +\
+                                         " out of inotify watches, walking '%s' every %g seconds instead" %\
+                                         (src, self.rescan)
+                    for wd, (watched_src, watched_path) in self.watches.items():
+                        if watched_src == src:
+                            self.inotify.remove_watch(wd)
+                            del self.watches[wd]
+                    self.polled[src] = time.time()
+                    return
+                continue    # Already gone, or can't be read - the dir it's in is still watched
+            pending.extend((child, os.path.join(node_path, child.name)) for child in node.children
+                           if child.children is not None)
+
+    def _handle(self, events):
+        #Mark the dirs events happened in as dirty. Returns True if any were
+        changed = False
+        for wd, mask, name in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                for src in self.roots:
+                    if src not in self.polled:
+                        self.dirty[src] = None
+                changed = True
+                continue
+            if wd not in self.watches:
+                continue
+            src, path = self.watches[wd]
+            if mask & Inotify.IN_IGNORED:
+                del self.watches[wd]    # The dir is gone, and the one it was in has heard about that
+                continue
+            if name.startswith('.') and not self.hidden[src]:
+                continue
+            if self.dirty.get(src, ()) is not None:
+                self.dirty.setdefault(src, set()).add(path)
+            changed = True
+        return changed
+
+    def wait(self, delay, timeout=None):
+        """Wait for source folders to change, and return the ones that did, once delay seconds go by without changes.
+
+        Changes are never held back for more than 10 times delay, so that a
+        file that is written to for hours still shows up. If nothing is ready
+        after timeout seconds, an empty list is returned.
+        """
+        started = time.time()
+        first_change = last_change = None
+        while True:
+            now = time.time()
+            for src, last_walk in self.polled.items():
+                if now - last_walk >= self.rescan:
+                    self.dirty[src] = None
+            if self.dirty:
+                if first_change is None:
+                    first_change = last_change = now
+                if now - last_change >= delay or now - first_change >= 10 * delay:
+                    return [src for src in self.roots if src in self.dirty]
+                wait_for = min(last_change + delay, first_change + 10 * delay) - now
+            else:
+                wait_for = min([last_walk + self.rescan - now for last_walk in self.polled.values()] or [None])
+            if timeout is not None:
+                if now - started >= timeout:
+                    return []
+                wait_for = min(wait_for, started + timeout - now) if wait_for is not None else \
+                    started + timeout - now
+
+            if self.inotify is None:
+                if wait_for is None:
+                    signal.pause()
+                else:
+                    time.sleep(wait_for)
+            elif self._handle(self.inotify.read(wait_for)):
+                last_change = time.time()
+
+    def _find(self, root, src, path):
+        #Return the Nodes from root down to the dir at path, or None if it isn't in the tree (any more)
+        chain = [root]
+        if path != src:
+            for name in os.path.relpath(path, src).split(os.sep):
+                for child in chain[-1].children:
+                    if child.name == name and child.children is not None:
+                        chain.append(child)
+                        break
+                else:
+                    return None
+        return chain
+
+    def _read_again(self, src, chain, path):
+        #Read the dir at the end of chain again, keeping the subdirs in it that are still the same dirs
+        node = chain[-1]
+        try:
+            fresh = new_node(node.name, os.stat(path) if len(chain) == 1 else os.lstat(path), self.inodes[src])
+        except OSError:
+            return      # It's gone - the dir it was in hears about that
+        if fresh.children is None:
+            return
+        try:
+            fresh.children = _read_dir(path, hidden=self.hidden[src], inodes=self.inodes[src])
+        except OSError as e:
+            fresh.error = e.strerror
+        old_dirs = dict((child.name, child) for child in node.children if child.children is not None)
+        for i, child in enumerate(fresh.children):
+            if child.children is None:
+                continue
+            old = old_dirs.get(child.name)
+            child_path = os.path.join(path, child.name)
+            if old is not None and (old.dev, old.ino) == (child.dev, child.ino):
+                #Anything that changed inside it was (or will be) read again on its own, so only its own stat is new
+                own_size = old.size - sum(grandchild.size for grandchild in _visible(old.children))
+                old.mode, old.blocks, old.mtime, old.nlink = child.mode, child.blocks, child.mtime, child.nlink
+                old.size += child.size - own_size
+                fresh.children[i] = old
+            else:
+                fresh.children[i] = scan_tree(child_path, hidden=self.hidden[src], inodes=self.inodes[src])
+                fresh.children[i].name = child.name
+                if src not in self.polled:
+                    self._watch_tree(src, fresh.children[i], child_path)
+        fresh.size += sum(child.size for child in _visible(fresh.children))
+
+        delta = fresh.size - node.size
+        for slot in Node.__slots__ + _InodeNode.__slots__:
+            setattr(node, slot, getattr(fresh, slot))
+        #Sizes of hidden dirs don't count towards the dir they are in, so stop at the first one
+        for i in range(len(chain) - 2, -1, -1):
+            if chain[i + 1].name.startswith('.'):
+                break
+            chain[i].size += delta
+
+    def refresh(self, src, stats=None):
+        """Bring the root Node of src up to date with what changed in it since the last time, and return it.
+
+        If stats is a dict, the number of entries in src and the bytes they
+        add up to go into it, like scan_tree does.
+        """
+        dirs = self.dirty.pop(src, set())
+        if dirs is None:
+            self.roots[src] = scan_tree(src, hidden=self.hidden[src], inodes=self.inodes[src])
+            if src in self.polled:
+                self.polled[src] = time.time()
+            else:
+                self._watch_tree(src, self.roots[src], src)
+        else:
+            #Deepest dirs first, so the dirs above them add up sizes that are already right
+            for path in sorted(dirs, key=lambda p: p.count(os.sep), reverse=True):
+                chain = self._find(self.roots[src], src, path)
+                if chain is not None:
+                    self._read_again(src, chain, path)
+
+        root = self.roots[src]
+        if stats is not None:
+            stats['entries'] = stats['bytes'] = 0
+            pending = [root]
+            while pending:
+                node = pending.pop()
+                stats['entries'] += len(node.children)
+                for child in node.children:
+                    #Only the entry's own size, like scan_tree counts it, before sizes are added up the tree
+                    if child.children is None:
+                        stats['bytes'] += child.size
+                    else:
+                        stats['bytes'] += child.size - sum(grandchild.size for grandchild in _visible(child.children))
+                        pending.append(child)
+        return root
+
+
+def git(*git_args, **kwargs):
+    """Run git with git_args, and return what it printed without the trailing newline.
+
+    The input keyword argument is sent to its stdin, and git runs in the
+    cwd keyword argument, if given. Raises subprocess.CalledProcessError if
+    git fails.
+    """
+    import subprocess
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(['git'] + list(git_args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=devnull, cwd=kwargs.get('cwd'))
+        output = process.communicate(kwargs.get('input'))[0]
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ['git'] + list(git_args))
+    return output.rstrip('\n')
+
+
+def git_snapshot(paths, gc_days=None, stats=None, cwd=None):
+    """Commit paths (relative to cwd, or the current dir) to the git repo cwd is in.
+
+    Only paths get staged, so the rest of the repo is never hashed again, and
+    the commit is built with plumbing commands. If nothing changed since HEAD,
+    no commit is made. If gc_days is given, 'git gc' also runs if it hasn't
+    been run by this for that many days.
+
+    If stats is a dict, how long each step took goes into it, and whether a
+    commit was made.
+    """
+    import subprocess
+    if stats is None:
+        stats = {}
+    started = time.time()
+    git('update-index', '--add', '-z', '--stdin', input=''.join(path + '\0' for path in paths), cwd=cwd)
+    stats['add_seconds'] = time.time() - started
+
+    started = time.time()
+    tree = git('write-tree', cwd=cwd)
+    try:
+        head = git('rev-parse', '-q', '--verify', 'HEAD^{commit}', cwd=cwd)
+    except subprocess.CalledProcessError:
+        head = None     # Brand new repo
+
+    stats['committed'] = head is None or git('rev-parse', head + '^{tree}', cwd=cwd) != tree
+    if head is None:
+        git('update-ref', 'HEAD', git('commit-tree', tree, '-m', time.ctime(), cwd=cwd), cwd=cwd)
+    elif stats['committed']:
+        git('update-ref', 'HEAD', git('commit-tree', tree, '-p', head, '-m', time.ctime(), cwd=cwd), head,
+            cwd=cwd)
+    stats['commit_seconds'] = time.time() - started
+
+    if gc_days is not None:
+        gc_stamp = os.path.join(cwd or os.curdir, git('rev-parse', '--git-dir', cwd=cwd), 'tree_check_gc')
+        try:
+            last_gc = os.path.getmtime(gc_stamp)
+        except OSError:
+            last_gc = 0
+        if time.time() - last_gc >= gc_days * 24 * 60 * 60:
+            started = time.time()
+            git('gc', '--quiet', cwd=cwd)
+            open(gc_stamp, 'w').close()
+            stats['gc_seconds'] = time.time() - started
+
+
+def run_report(source_stats, total_stats, git_stats, started):
+    """Return the --stats report for a run (or a --watch update) that started at started."""
+    report = {'sources': source_stats,
+              'totals': total_stats,
+              'seconds': time.time() - started,
+              'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+              'finished': time.time()}
+    if git_stats is not None:
+        report['git'] = git_stats
+    return report
+
+
+def _prometheus_label(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_stats(out, stats, prometheus=False):
+    """Write the --stats report in stats to out, as JSON, or in the Prometheus textfile format."""
+    import json
+    if not prometheus:
+        json.dump(stats, out, indent=4, sort_keys=True)
+        out.write('\n')
+        return
+
+    metrics = [('source_seconds', 'Seconds spent walking a source folder and writing its outputs',
+                [('source', s['source'], s['seconds']) for s in stats['sources']]),
+               ('source_entries', 'Entries found in a source folder',
+                [('source', s['source'], s['entries']) for s in stats['sources']]),
+               ('source_bytes', 'Bytes the entries found in a source folder add up to',
+                [('source', s['source'], s['bytes']) for s in stats['sources']]),
+               ('source_entries_per_second', 'Entries found per second in a source folder',
+                [('source', s['source'], s['entries_per_second']) for s in stats['sources']]),
+               ('source_output_bytes', 'Bytes written for the listings and snapshot of a source folder',
+                [('source', s['source'], s['output_bytes']) for s in stats['sources']]),
+               ('total_output_bytes', 'Bytes written to a -t output file',
+                [('output', t['output'], t['output_bytes']) for t in stats['totals']])]
+    if any('hashed_files' in s for s in stats['sources']):
+        metrics += [('source_hashed_files', 'Files in a source folder that were read to hash them',
+                     [('source', s['source'], s['hashed_files']) for s in stats['sources'] if 'hashed_files' in s]),
+                    ('source_hashed_bytes', 'Bytes read to hash files in a source folder',
+                     [('source', s['source'], s['hashed_bytes']) for s in stats['sources'] if 'hashed_files' in s])]
+    if 'git' in stats:
+        metrics += [('git_%s' % key, 'Time taken by the git %s step, in seconds' % key.split('_')[0],
+                     [(None, None, stats['git'][key])]) for key in ('add_seconds', 'commit_seconds', 'gc_seconds')
+                    if key in stats['git']]
+        metrics.append(('git_committed', 'Whether the git step made a new commit',
+                        [(None, None, int(stats['git']['committed']))]))
+    metrics += [('run_seconds', 'Seconds the whole run took', [(None, None, stats['seconds'])]),
+                ('peak_rss_bytes', 'Peak resident set size of the run', [(None, None, stats['peak_rss_bytes'])]),
+                ('last_run_timestamp_seconds', 'When the run finished', [(None, None, stats['finished'])])]
+
+    for name, help_text, samples in metrics:
+        out.write('# HELP tree_check_%s %s\n' % (name, help_text))
+        out.write('# TYPE tree_check_%s gauge\n' % name)
+        for label, label_value, value in samples:
+            out.write('tree_check_%s%s %s\n' % (name, '{%s=%s}' % (label, _prometheus_label(label_value))
+                                                if label else '', json.dumps(value)))
+
+
+def build_parser():
+    """Return the argument parser for running tree_check.py on source folders (not for its commands)."""
+    import argparse
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     usage=("\t%s (-f OUT_DIR SRC_DIR... | -t OUT_FILE SRC_DIR...)\n" %
+                                            os.path.basename(sys.argv[0]) +
+                                            "\t\t      [--config CONFIG_FILE]\n" +
+                                            "\t\t      [-g GIT_ROOT_DIR [--git-gc DAYS]] [-i]\n" +
+                                            "\t\t      [-j JOBS] [--mount-jobs JOBS] [--mount-timeout SECONDS]\n" +
+                                            "\t\t      [-c CACHE_DIR [--full-rescan] [--quick-check SECONDS]]\n" +
+                                            "\t\t      [-s SNAP_DIR] [--index INDEX_FILE] [--stats FILE]\n" +
+                                            "\t\t      [--hash [--hash-jobs JOBS] [--hash-report FILE]]\n" +
+                                            "\t\t      [--watch SECONDS [--watch-commit SECONDS]\n" +
+                                            "\t\t       [--watch-rescan SECONDS]]\n" +
+                                            "\t%s diff OLD_SNAPSHOT NEW_SNAPSHOT\n" % os.path.basename(sys.argv[0]) +
+                                            "\t%s query INDEX_FILE (--depth N | --largest K | --name GLOB |\n" %
+                                            os.path.basename(sys.argv[0]) +
+                                            "\t\t\t\t --which PATH) [--under PATH]\n" +
+                                            "\t%s -h | --help\n" % os.path.basename(sys.argv[0]) +
+                                            "\t%s -e | --examples\n" % os.path.basename(sys.argv[0]) +
+                                            "\t%s -v | --version" % os.path.basename(sys.argv[0])),
+                                     add_help=False)
+    parser.add_argument("-c", "--cache", metavar="CACHE_DIR")
+    parser.add_argument("--config", metavar="CONFIG_FILE")
+    parser.add_argument("-e", "--examples", action="store_true")
+    parser.add_argument("-f", "--folder", metavar=("OUT_DIR", "SRC_DIR"), nargs="*", action="append")
+    parser.add_argument("-g", "--git", metavar="GIT_ROOT_DIR")
+    parser.add_argument("--git-gc", metavar="DAYS", type=float)
+    parser.add_argument("-h", "--help", action="store_true")
+    parser.add_argument("--hash", action="store_true")
+    parser.add_argument("--hash-jobs", metavar="JOBS", type=int, default=4)
+    parser.add_argument("--hash-report", metavar="FILE")
+    parser.add_argument("--full-rescan", action="store_true")
+    parser.add_argument("-i", "--ignore", action="store_true")
+    parser.add_argument("--index", metavar="INDEX_FILE")
+    parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=1)
+    parser.add_argument("--mount-jobs", metavar="JOBS", type=int, default=1)
+    parser.add_argument("--mount-timeout", metavar="SECONDS", type=float, default=10)
+    parser.add_argument("--quick-check", metavar="SECONDS", type=float)
+    parser.add_argument("-s", "--snapshot", metavar="SNAP_DIR")
+    parser.add_argument("--stats", metavar="FILE")
+    parser.add_argument("-t", "--total", metavar=("OUT_FILE", "SRC_DIR"), nargs="*", action="append")
+    parser.add_argument('-v', '--version', action='version', version=('%(prog)s ' + __version__))
+    parser.add_argument("--watch", metavar="SECONDS", type=float)
+    parser.add_argument("--watch-commit", metavar="SECONDS", type=float, default=300)
+    parser.add_argument("--watch-rescan", metavar="SECONDS", type=float, default=3600)
+    return parser
+
+
+def print_help(parser):
+    """Print the -h help, which is the usage of parser and a description of every option."""
+    parser.print_usage()
+
+    print '''
+Walk source folders, and list them the way "tree --du -h -F" does, in a way that:
+    * Makes the output easily grepable
+    * Shows dir and file sizes in a human readable way
+and write the output to a desired location.
+
+Optional Arguments:
+    -h, --help          Show this help message and exit
+    -c CACHE_DIR, --cache CACHE_DIR
+                        Keep a scan cache for every source folder in
+                        CACHE_DIR, so that dirs that did not change since the
+                        last run do not have to be read again. The last folder
+                        in the CACHE_DIR path will get created if it does not
+                        exist. Keep it out of GIT_ROOT_DIR
+    --config CONFIG_FILE
+                        Read -f and -t jobs, and any other options that are
+                        not given on the command line, from the JSON file
+                        CONFIG_FILE. -t jobs in it can split their source
+                        folders into named groups. See README.md
+    -e, --examples      Show usage examples
+    -f OUT_DIR SRC_DIR..., --folder OUT_DIR SRC_DIR...
+                        Specify output folder. Can be specified multiple
+                        times. The last folder in the OUT_DIR path will get
+                        created if it does not exist
+    -g GIT_ROOT_DIR, --git GIT_ROOT_DIR
+                        Enable git. Uses git to version control output after
+                        generating it. GIT_ROOT_DIR is the root of the git
+                        repo. Only the output files are committed, and only
+                        if something changed
+    --git-gc DAYS       Run 'git gc' on the git repo if it hasn't been for
+                        DAYS days, to pack all the similar listings together
+    --full-rescan       Ignore what is in the scan cache and read every dir
+                        again. With --hash, every file is read again too. The
+                        cache is still updated afterwards
+    --hash              Also write the SHA-1 of every file in every -f
+                        listing next to it, with '.sha1' added to its name,
+                        in the format 'sha1sum -c' checks. With -c, files
+                        that still have the same inode, size and mtime are
+                        not read again
+    --hash-jobs JOBS    With --hash, read up to JOBS files of a source folder
+                        at the same time. Defaults to 4
+    --hash-report FILE  With --hash, write every file with content that is
+                        not in any other -f OUT_DIR to FILE, one section per
+                        OUT_DIR. That's what would be lost if the one it is
+                        on went away
+    -i, --ignore        Ignore empty and non-existent source directories.
+                        Useful when dealing with mounted filesystems that may
+                        be unmounted once in a while when %s is
+                        running. Empty mount points that do have something
+                        mounted on them are not ignored
+    --index INDEX_FILE  Keep every -f listing in the INDEX_FILE database too,
+                        for the query command. Only listings with entries
+                        that changed get updated
+    -j JOBS, --jobs JOBS
+                        Walk up to JOBS source folders at the same time.
+                        Defaults to 1
+    --mount-jobs JOBS   When using -j, never walk more than JOBS source
+                        folders that are on the same filesystem at the same
+                        time. Defaults to 1, so that one slow NAS only ever
+                        gets one job at a time
+    --mount-timeout SECONDS
+                        Give up on source folders that take longer than
+                        SECONDS to answer, like ones on network filesystems
+                        (NFS, SMB, ...) when their server is down. With -i they
+                        get skipped, and without it %s exits.
+                        Defaults to 10
+    --quick-check SECONDS
+                        Exit right away, without walking anything, if the
+                        last full run with the same arguments was less than
+                        SECONDS ago, and since then nothing was added,
+                        removed or renamed right in any source folder, and
+                        no output file changed. Changes further in are only
+                        seen by the next full run, so outputs can be up to
+                        SECONDS old. The state of the last full run is kept
+                        in CACHE_DIR
+    -s SNAP_DIR, --snapshot SNAP_DIR
+                        Also save a compact snapshot of every -f source folder
+                        in SNAP_DIR, in a folder named after its OUT_DIR, with
+                        the name of its listing and '.snap' at the end. The
+                        snapshot from the last time it changed is kept with
+                        '.prev' added to that. The last folder in the SNAP_DIR
+                        path will get created if it does not exist
+    --stats FILE        Write how long every source folder and the git step
+                        took, how much was found and written, and the peak
+                        memory use to FILE. FILE is in the Prometheus textfile
+                        format if it ends with '.prom', and JSON otherwise
+    -t OUT_FILE SRC_DIR..., --total OUT_FILE SRC_DIR...
+                        Create OUT_FILE with data about the total sizes of
+                        SRC_DIRs. Can be specified multiple times. If -i flag
+                        is used, %s checks if the current OUT_FILE
+                        has any changes besides the empty/non-existent dirs.
+                        If there are none, it ignores the OUT_FILE completely.
+    -v, --version       Show program's version number and exit
+    --watch SECONDS     After the first run, keep running, and keep the
+                        outputs up to date as the source folders change.
+                        Source folders on local filesystems are watched with
+                        inotify, and only the dirs that changed are read
+                        again. Outputs are rewritten once nothing has changed
+                        for SECONDS, and only the ones with a changed source
+                        folder in them
+    --watch-commit SECONDS
+                        With --watch and -g, commit at most once every
+                        SECONDS. Defaults to 300
+    --watch-rescan SECONDS
+                        With --watch, walk source folders that can't be
+                        watched (like ones on NFS, where inotify never hears
+                        about changes made by other machines) again every
+                        SECONDS. Source folders -i skipped get checked again
+                        that often too, and are walked and watched once they
+                        are back. Defaults to 3600
+
+Commands:
+    diff OLD_SNAPSHOT NEW_SNAPSHOT
+                        List every entry that was added (+), removed (-) or
+                        resized (~) between 2 snapshots
+    query INDEX_FILE (--depth N | --largest K | --name GLOB | --which PATH)
+          [--under PATH]
+                        Look up entries N levels in, the K largest entries,
+                        entries with a name that matches GLOB, or which
+                        listings have PATH in them, without reading through
+                        the listings. See '%s query -h'
+
+Exit Status:
+    0 if OK
+    1 if Errors caused an early exit''' % (os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]),
+                                           os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]))
+
+
+def print_examples(parser):
+    """Print the -h help, and then the -e examples."""
+    print_help(parser)
+    print """
+Examples:
+    Run tree on /etc, and put the output into the current folder:
+        $ %s -f . /etc
+
+    Run tree on /etc, and put the output into a folder called PC1:
+    Note: Folder 'PC1' is created automatically
+        $ %s -f PC1 /etc
+
+    Run tree on /etc, and put the output into the current folder.
+    Also run tree on '/SOME FOLDER' and put the output into the folder
+    called 'Machine 2':
+    Note: Folder 'Machine 2' is created automatically
+        $ %s -f . /etc -f Machine\ 2 /SOME\ FOLDER
+        OR
+        $ %s -f . /etc -f 'Machine 2' '/SOME FOLDER'
+
+    Run tree on /etc, and put the output into the current folder.
+    Then run tree on /var and /usr, and put the output of both into
+    a folder called PC1.
+    Finally run tree on /home, and put the output into the current
+    folder too:
+    Note: Folder 'PC1' is created automatically
+        $ %s -f . /etc -f PC1 /var /usr -f . /home
+
+    Run tree on /etc, and make the output folder
+    '/home/user/test folder/Machine 1'.
+    Run tree on /var, and make the output folder
+    '/home/user/test folder/Machine 2'.
+    Set the git repo root folder to '/home/user/test folder/',
+    and make a git snapshot.
+    Note: In this case, the '/home/user/test folder/'
+      dir must already exist, while the 'Machine 1' and 'Machine 2'
+      folders are created automatically
+        $ %s -f '/home/user/test folder/Machine 1' \\
+            /etc -f '/home/user/test folder/Machine 2' /var \\
+            -g '/home/user/test folder'
+
+    Run 'du -hcs' on /etc and /var, and put the output in a
+    file called 'etc_var_totals'.
+    Also run 'du -hcs' on /home and /usr and put the output
+    in a file called 'home_usr_totals'.
+    Then make a git snapshot of the output folder:
+        $ %s -t etc_var_totals /etc /var \\
+            -t home_usr_totals /home /usr -g .
+
+    Run tree on '/etc', and run 'du -hcs' on /var before taking a
+    snapshot of the output folder with git:
+        $ %s -f . /etc -t totals /var -g .""" % (os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]),
+                                                 os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]),
+                                                 os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]),
+                                                 os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]))
+
+
+def diff_main():
+    """The 'diff' command: list what changed between 2 snapshots."""
+    import argparse
+    diff_parser = argparse.ArgumentParser(prog="%s diff" % os.path.basename(sys.argv[0]),
+                                          description="List what was added (+), removed (-) and resized (~) " +
+                                                      "between 2 snapshots made with --snapshot")
+    diff_parser.add_argument("old", metavar="OLD_SNAPSHOT")
+    diff_parser.add_argument("new", metavar="NEW_SNAPSHOT")
+    diff_args = diff_parser.parse_args(sys.argv[2:])
+    try:
+        old_snapshot = Snapshot(diff_args.old)
+        new_snapshot = Snapshot(diff_args.new)
+        for line in diff_snapshots(old_snapshot, new_snapshot):
+            sys.stdout.write(line)
+    except (IOError, OSError, ValueError, struct.error, mmap.error):
+        diff_parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " failed to read '%s' or '%s' as snapshots" % (diff_args.old, diff_args.new)
+        exit(1)
+    exit(0)
+
+
+def query_main():
+    """The 'query' command: look up entries in an index made with --index."""
+    import argparse
+    import sqlite3
+    query_parser = argparse.ArgumentParser(prog="%s query" % os.path.basename(sys.argv[0]),
+                                           description="Look up entries in the listings added to INDEX_FILE " +
+                                                       "with --index")
+    query_parser.add_argument("index", metavar="INDEX_FILE")
+    query_type = query_parser.add_mutually_exclusive_group(required=True)
+    query_type.add_argument("--depth", metavar="N", type=int,
+                            help="entries N levels in (1 is the top level of a listing)")
+    query_type.add_argument("--largest", metavar="K", type=int, help="the K largest entries")
+    query_type.add_argument("--name", metavar="GLOB", help="entries with a name that matches GLOB")
+    query_type.add_argument("--which", metavar="PATH", help="the listings PATH is in")
+    query_parser.add_argument("--under", metavar="PATH", help="only look at entries under PATH")
+    query_args = query_parser.parse_args(sys.argv[2:])
+    if not os.path.isfile(query_args.index):
+        query_parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '%s' is not a valid path for an index file" % query_args.index
+        exit(1)
+    try:
+        for line in query_index(open_index(query_args.index), query_args.depth, query_args.largest,
+                                query_args.name, query_args.which, query_args.under):
+            sys.stdout.write(line)
+    except sqlite3.Error:
+        query_parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " failed to read '%s' as an index file" % query_args.index
+        exit(1)
+    exit(0)
+
+
+def main():
+    """Run tree_check.py with the arguments in sys.argv, then exit."""
+    #Handle Ctrl+C
+    signal.signal(signal.SIGINT, signal_handler)
+    _get_umask()
+
+    #Sort names the same way tree does (strcoll in the user's locale), and escape the same characters in them
+    for category in (locale.LC_COLLATE, locale.LC_CTYPE):
+        try:
+            locale.setlocale(category, '')
+        except locale.Error:
+            pass
+
+    #'diff' compares snapshots instead of walking source folders, so it gets its own arguments
+    if len(sys.argv) > 1 and sys.argv[1] == "diff":
+        diff_main()
+
+    #'query' looks things up in the index made with --index, so it gets its own arguments too
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        query_main()
+
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if args.help:
+        print_help(parser)
+        exit(0)
+
+    #If examples arg passed, show help with examples and exit
+    if args.examples:
+        print_examples(parser)
+        exit(0)
+
+    #Add what's in the config file to what was given on the command line
+    total_groups = [None] * len(args.total or [])
+    ignore_sources = set()
+    if args.config:
+        try:
+            config_folders, config_totals, config_groups, config_options, ignore_sources = \
+                load_config(os.path.expanduser(args.config))
+        except ConfigError as e:
+            parser.print_usage(file=sys.stderr)
+            print >> sys.stderr, "%s: error: %s" % (os.path.basename(sys.argv[0]), e)
+            exit(1)
+        args.folder = (args.folder or []) + config_folders or None
+        args.total = (args.total or []) + config_totals or None
+        total_groups += config_groups
+        for key, value in config_options.items():
+            if getattr(args, key) == parser.get_default(key):
+                setattr(args, key, value)
+
+    #If no arguments are given, give warning and exit
+    if len(sys.argv) == 1:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " need at least a '-f', '-t' or '--config' argument to run"
+        exit(1)
+
+    #Check number of git, ignore, and folder args
+    git_args = 0
+    ignore_args = 0
+    folder_args = 0
+    total_args = 0
+    #Note: The [:2] catches tricky arg combinations like -gfi
+    for i in range(1, len(sys.argv)):
+        if sys.argv[i][:2] == "-g" or sys.argv[i] == "--git":
+            git_args += 1
+        if sys.argv[i][:2] == "-i" or sys.argv[i] == "--ignore":
+            ignore_args += 1
+        if sys.argv[i][:2] == "-f" or sys.argv[i] == "--folder":
+            folder_args += 1
+        if sys.argv[i][:2] == "-t" or sys.argv[i] == "--total":
+            total_args += 1
+    if git_args > 1:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " only one '--git' argument allowed"
+        exit(1)
+    if git_args == 1 or args.git:
+        #If git is enabled, either -f or -t must be as well
+        if not args.folder and not args.total:
+            parser.print_usage(file=sys.stderr)
+            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                 " '--git' can not be enabled without either '-f' or '-t'"
+            exit(1)
+    if ignore_args > 1:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " only one '--ignore' argument allowed"
+        exit(1)
+
+    #--git-gc needs a git repo, and a sane number of days
+    if args.git_gc is not None and (not args.git or args.git_gc < 0):
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--git-gc' needs '--git', and can not be negative"
+        exit(1)
+
+    #Only -f listings go into the query index
+    if args.index and not args.folder:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " '--index' can not be used without '-f'"
+        exit(1)
+
+    #Only -f listings get hashed, and the other hash options need hashing
+    if args.hash and not args.folder:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " '--hash' can not be used without '-f'"
+        exit(1)
+    if not args.hash and (args.hash_report or args.hash_jobs != parser.get_default("hash_jobs")):
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--hash-jobs' and '--hash-report' can not be used without '--hash'"
+        exit(1)
+    if args.hash_jobs < 1:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " '--hash-jobs' must be at least 1"
+        exit(1)
+    #The --quick-check state is kept in the cache dir, and a daemon has no use for it
+    if args.quick_check is not None and (not args.cache or args.watch is not None or args.quick_check <= 0):
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--quick-check' needs '--cache', can not be used with '--watch', and must be more than 0"
+        exit(1)
+    #The scan cache has to be enabled to be ignored
+    if args.full_rescan and not args.cache:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--full-rescan' can not be used without '--cache'"
+        exit(1)
+
+    #Make sure the job limits make sense
+    if args.mount_timeout <= 0:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " '--mount-timeout' must be more than 0"
+        exit(1)
+    if args.jobs < 1 or args.mount_jobs < 1:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--jobs' and '--mount-jobs' must be at least 1"
+        exit(1)
+    #Make sure the --watch timings make sense, and aren't given without it
+    if args.watch is None and (args.watch_commit != parser.get_default("watch_commit") or
+                               args.watch_rescan != parser.get_default("watch_rescan")):
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--watch-commit' and '--watch-rescan' can not be used without '--watch'"
+        exit(1)
+    if args.watch is not None and not args.folder and not args.total:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--watch' can not be used without '-f' or '-t'"
+        exit(1)
+    if args.watch is not None and (args.watch < 0 or args.watch_commit < 0 or args.watch_rescan <= 0):
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                             " '--watch' and '--watch-commit' can not be negative, " +\
+                             "and '--watch-rescan' must be more than 0"
+        exit(1)
+
+    #Make sure the '-f' option always has at least 2 arguments (1 output folder and 1 source folder)
+    if args.folder:
+        for i in range(0, len(args.folder)):
+            if len(args.folder[i]) < 2:
+                parser.print_usage(file=sys.stderr)
+                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                     " '--folder' must have at least 2 arguments"
+                exit(1)
+
+    #Make sure the '-t' option always has at least 2 arguments (1 output file and 1 source folder)
+    if args.total:
+        for i in range(0, len(args.total)):
+            if len(args.total[i]) < 2:
+                parser.print_usage(file=sys.stderr)
+                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                     " '--total' must have at least 2 arguments"
+                exit(1)
+
+    #Find out which source folders are there, empty or on a hung mount, once, without waiting on any for too long
+    source_states = check_sources([os.path.expanduser(src) for sources in (args.folder or []) + (args.total or [])
+                                   for src in sources[1:]], args.mount_timeout)
+
+    #Check if all source and output folders are valid
+    if args.folder:     # Check if '-f' was ever passed to the script
+        for i in range(0, len(args.folder)):    # For every list in args.folder
+            for x in range(0, len(args.folder[i])):     # For every item in the current list
+                if x == 0:  # args.folder[i][0] is always the output folder (ex: -f OUTPUT_FOLDER SRC SRC SRC)
+                    #The output folder does not need to exist if it doesn't start with / or ~
+                    if args.folder[i][x][0] == "/" or args.folder[i][x][0] == "~":
+                        #Check if the dirname of the output folder exists - we can create the last folder if it doesn't
+                        if not os.path.isdir(os.path.expanduser(os.path.dirname(args.folder[i][x].rstrip("/")))):
+                            parser.print_usage(file=sys.stderr)
+                            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                 (" '%s' is not a valid path " %
+                                                  os.path.dirname(args.folder[i][x].rstrip("/")) +
+                                                  "for an output folder")
+                            exit(1)
+                else:
+                    #Make sure we weren't specifically told to ignore non-existent source folders
+                    if not args.ignore and args.folder[i][x] not in ignore_sources:
+                        #Check if the source folder exists
+                        if source_states[os.path.expanduser(args.folder[i][x])][0] == 'hung':
+                            parser.print_usage(file=sys.stderr)
+                            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                 (" '%s' did not respond within %g seconds" %
+                                                  (args.folder[i][x], args.mount_timeout))
+                            exit(1)
+                        if source_states[os.path.expanduser(args.folder[i][x])][0] == 'missing':
+                            parser.print_usage(file=sys.stderr)
+                            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                 (" '%s' is not a valid path for a "
+                                                  "source folder" % args.folder[i][x])
+                            exit(1)
+
+    #Check if all -t options are valid
+    if args.total:
+        for i in range(0, len(args.total)):     # For every list in args.total
+            for x in range(0, len(args.total[i])):   # For every item in the current list
+                #args.total[i][0] is always the output file (ex: -t total /etc /var OR -t ~/total /etc /var)
+                if x == 0:
+                    #Make sure that the user is giving us a file instead of a dir
+                    if args.total[i][x][-1] == "/" or args.total[i][x][-1] == ".":
+                        parser.print_usage(file=sys.stderr)
+                        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                             " '%s' is a dir, when we are expecting a filename or file path" %\
+                                             args.total[i][x]
+                        exit(1)
+
+                    #Make sure that the user is not giving us an existing directory
+                    if os.path.isdir(os.path.expanduser(args.total[i][x])):
+                        parser.print_usage(file=sys.stderr)
+                        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                             (" '%s' is an existing dir, when we are expecting a filename or " %
+                                              args.total[i][x] + "file path")
+                        exit(1)
+
+                    #The dirname does not need to exist if it doesn't start with / or ~
+                    if args.total[i][x][0] == "/" or args.total[i][x][0] == "~":
+                        #Check if the dirname of the output folder exists - we will create the file
+                        if not os.path.isdir(os.path.expanduser(os.path.dirname(args.total[i][x].rstrip("/")))):
+                            parser.print_usage(file=sys.stderr)
+                            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                 (" '%s' is not a valid path "
+                                                  % os.path.dirname(args.total[i][x].rstrip("/")) +
+                                                  "for an output folder for --total")
+                            exit(1)
+                else:
+                    #Make sure we weren't specifically told to ignore non-existent folders
+                    if not args.ignore and args.total[i][x] not in ignore_sources:
+                        #Check if the source folder exists
+                        if source_states[os.path.expanduser(args.total[i][x])][0] == 'hung':
+                            parser.print_usage(file=sys.stderr)
+                            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                 (" '%s' did not respond within %g seconds" %
+                                                  (args.total[i][x], args.mount_timeout))
+                            exit(1)
+                        if source_states[os.path.expanduser(args.total[i][x])][0] == 'missing':
+                            parser.print_usage(file=sys.stderr)
+                            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                 (" '%s' is not a valid path " % args.total[i][x] +
+                                                  "for a source folder for --total")
+                            exit(1)
+
+    #Check if git root folder is valid
+    GIT_VALID = False
+    if args.git:
+        if not os.path.isdir(os.path.expanduser(args.git)):
+            if args.folder:
+                #Check if it's listed as an output folder
+                for i in range(0, len(args.folder)):
+                    if os.path.abspath(os.path.expanduser(args.folder[i][0]).rstrip("/")) ==\
+                            os.path.abspath(os.path.expanduser(args.git).rstrip("/")):
+                        GIT_VALID = True
+                        break
+                if not GIT_VALID:
+                    parser.print_usage(file=sys.stderr)
+                    print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                         " '%s' is an invalid path for a git repo" % args.git
+                    exit(1)
+            else:
+                parser.print_usage(file=sys.stderr)
+                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                     " '%s' is an invalid path for a git repo" % args.git
+                exit(1)
+
+    #Create the cache and snapshot folders if they don't exist
+    for extra_dir, kind in ((args.cache, "cache"), (args.snapshot, "snapshot")):
+        if extra_dir and not os.path.isdir(os.path.expanduser(extra_dir)):
+            try:
+                os.makedirs(os.path.expanduser(extra_dir))
+            except OSError:
+                parser.print_usage(file=sys.stderr)
+                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                     " unable to create '%s' %s directory" % (extra_dir, kind)
+                exit(1)
+
+    #Work out which source folders -f and -t need, and every output they go into, going by source_states.
+    #With --watch, that is worked out again when source folders -i skipped come back
+    hash_report_path = args.hash_report and os.path.expanduser(args.hash_report)
+
+    def plan_outputs():
+        sources = []    # Every source folder that needs to be walked, in the order they were given
+        folder_outputs = {}     # Source folder -> the -f output files it gets listed to
+        totals = set()  # Source folders that -t needs the sizes of
+        if args.folder:
+            folder_jobs = []
+            for i in range(0, len(args.folder)):    # For every list in args.folder
+                for x in range(0, len(args.folder[i])):     # For every item in the current list
+                    if x == 0:      # args.folder[i][0] is always the output folder (ex: -f OUTPUT_FOLDER SRC SRC SRC)
+                        #If the output folder doesn't exist
+                        if not os.path.isdir(os.path.expanduser(args.folder[i][x])):
+                            #Make sure there isn't a file with the same name already there
+                            if os.path.isfile(os.path.expanduser(args.folder[i][x])):
+                                parser.print_usage(file=sys.stderr)
+                                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                     " unable to create '%s' output directory" %\
+                                                     args.folder[i][x]
+                                print >> sys.stderr, "%s: error: a file with that name already exists" %\
+                                                     os.path.basename(sys.argv[0])
+                                exit(1)
+
+                            try:
+                                os.makedirs(os.path.expanduser(args.folder[i][x]))
+                            except OSError:
+                                parser.print_usage(file=sys.stderr)
+                                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                                     " unable to create '%s' output directory" %\
+                                                     args.folder[i][x]
+                                print >> sys.stderr, "%s: error: check your permissions" % os.path.basename(sys.argv[0])
+                                exit(1)
+                    else:   # For every source folder
+                        #If the source folder doesn't exist, or is on a hung mount
+                        if source_states[os.path.expanduser(args.folder[i][x])][0] in ('missing', 'hung'):
+                            continue    # Skip it. We're clearly using -i, or it would have been caught earlier
+                        if (args.ignore or args.folder[i][x] in ignore_sources) and \
+                                source_states[os.path.expanduser(args.folder[i][x])][0] == 'empty':
+                            continue    # Skip it. Ex: NFS mounts that exist, but are not mounted
+
+                        folder_jobs.append((os.path.expanduser(args.folder[i][x]),
+                                            "%s/%s" % (os.path.expanduser(args.folder[i][0]),
+                                                       os.path.basename(args.folder[i][x].rstrip("/")))))
+
+            #If 2 source folders share an output file, only the last one would have survived, so only list that one
+            for n in range(0, len(folder_jobs)):
+                if folder_jobs[n][1] not in [out_path for src, out_path in folder_jobs[n + 1:]]:
+                    if folder_jobs[n][0] not in folder_outputs:
+                        sources.append(folder_jobs[n][0])
+                        folder_outputs[folder_jobs[n][0]] = []
+                    folder_outputs[folder_jobs[n][0]].append(folder_jobs[n][1])
+
+        total_files = []
+        if args.total:
+            for i in range(0, len(args.total)):     # For every -t option
+                Do_Not_Skip = False
+                #Find out if any of the source files for the current -t option have changed
+                #For every argument to current -t, except the first (output file)
+                for y in range(1, len(args.total[i])):
+                    #Check if the current argument is not ignored, or is an existing directory that is not empty
+                    if (not args.ignore and args.total[i][y] not in ignore_sources) or\
+                            source_states[os.path.expanduser(args.total[i][y])][0] == 'ok':
+                        Do_Not_Skip = True
+                        break
+
+                if not Do_Not_Skip:
+                    #Skip current -t output file - other than empty and non-existent folders, there's no change
+                    continue
+
+                #Remember what goes into this output file, so the sections can be written in order.
+                #Group headers from the config file are sections without a source folder
+                sections = []
+                groups = list(total_groups[i] or [])
+                group_left = 0
+                #For every argument to current -t, except the first (output file)
+                for x in range(1, len(args.total[i])):
+                    if groups and not group_left:
+                        group_name, group_left = groups.pop(0)
+                        sections.append((None, group_name + '\n' + '=' * len(group_name) + '\n\n'))
+                    group_left -= 1
+
+                    src = os.path.expanduser(args.total[i][x])
+                    ignore = args.ignore or args.total[i][x] in ignore_sources
+                    if ignore and source_states[src][0] == 'missing':
+                        sections.append((src, "'%s' does not exist" % src))
+                    elif ignore and source_states[src][0] == 'hung':
+                        sections.append((src, "'%s' did not respond" % src))
+                    elif ignore and source_states[src][0] == 'empty':
+                        sections.append((src, "'%s' is empty" % src))
+                    else:
+                        sections.append((src, None))
+                        if src not in totals and src not in folder_outputs:
+                            sources.append(src)
+                        totals.add(src)
+                total_files.append((args.total[i][0], sections))
+
+        #For --hash-report, every OUT_DIR and the source folders listed into it, in the order they were given
+        hash_groups = []
+        if args.hash_report:
+            for src in sources:
+                for out_path in folder_outputs.get(src, []):
+                    for out_dir, group_sources in hash_groups:
+                        if os.path.abspath(out_dir) == os.path.abspath(os.path.dirname(out_path)):
+                            break
+                    else:
+                        out_dir, group_sources = os.path.dirname(out_path), []
+                        hash_groups.append((out_dir, group_sources))
+                    if src not in group_sources:
+                        group_sources.append(src)
+
+        #Snapshots are named after the (first) listing of their source folder, and the OUT_DIR it's in
+        snapshot_paths = {}
+        if args.snapshot:
+            for src in sources:
+                if src in folder_outputs:
+                    out_path = folder_outputs[src][0]
+                    snapshot_path = "%s/%s/%s.snap" % (os.path.expanduser(args.snapshot),
+                                                       os.path.basename(os.path.abspath(os.path.dirname(out_path))),
+                                                       os.path.basename(out_path))
+                    if snapshot_path in snapshot_paths.values():
+                        parser.print_usage(file=sys.stderr)
+                        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                             " more than one source folder would be saved to the snapshot '%s'" %\
+                                             snapshot_path
+                        exit(1)
+                    snapshot_paths[src] = snapshot_path
+            for snapshot_dir in set(os.path.dirname(snapshot_path) for snapshot_path in snapshot_paths.values()):
+                if not os.path.isdir(snapshot_dir):
+                    try:
+                        os.mkdir(snapshot_dir)
+                    except OSError:
+                        parser.print_usage(file=sys.stderr)
+                        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                             " unable to create '%s' snapshot directory" % snapshot_dir
+                        exit(1)
+
+        #Every output file this run writes (whether or not it changes) - the only ones git needs to look at
+        output_paths = [os.path.abspath(out_path + suffix)
+                        for src in sources for out_path in folder_outputs.get(src, [])
+                        for suffix in (('', '.sha1') if args.hash else ('',))] +\
+                       [os.path.abspath(out_file) for out_file, sections in total_files] +\
+                       ([os.path.abspath(hash_report_path)] if args.hash_report else [])
+        return sources, folder_outputs, totals, total_files, hash_groups, snapshot_paths, output_paths
+
+    sources, folder_outputs, totals, total_files, hash_groups, snapshot_paths, output_paths = plan_outputs()
+
+    #With --quick-check, stop here if the last full run was recent enough, and nothing it looked at has changed
+    #since: not the dirs of the source folders themselves (or the config file), and not the output files
+    if args.quick_check is not None:
+        quick_path = quick_check_path(os.path.expanduser(args.cache), sys.argv[1:])
+        source_stamps = file_stamps(sources + ([os.path.expanduser(args.config)] if args.config else []))
+        last_run = load_cache(quick_path)
+        if last_run and time.time() - last_run['started'] < args.quick_check and \
+                last_run['sources'] == source_stamps and last_run['outputs'] == file_stamps(output_paths):
+            exit(0)
+
+    #Walk each of them once (on up to --jobs threads), then write the -t output files
+    try:
+        results = run_jobs([(source_states[src][1], scan_source,
+                             (src, folder_outputs.get(src, []), src in totals,
+                              args.cache and os.path.expanduser(args.cache), args.full_rescan,
+                              snapshot_paths.get(src), args.index and os.path.abspath(os.path.expanduser(args.index)),
+                              args.watch is not None, args.hash_jobs if args.hash else 0))
+                            for src in sources],
+                           args.jobs, args.mount_jobs)
+        results = dict(zip(sources, results))
+    except JobError as e:
+        parser.print_usage(file=sys.stderr)
+        print >> sys.stderr, "%s: error: %s" % (os.path.basename(sys.argv[0]), e)
+        exit(1)
+
+    sizes = dict((src, results[src][0]) for src in totals)
+    total_stats = []
+    for out_file, sections in total_files:
+        try:
+            total_stats.append(write_total(out_file, sections, sizes))
+        except (OSError, IOError):
+            parser.print_usage(file=sys.stderr)
+            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " failed to write to '%s'" % out_file
+            exit(1)
+
+    hashes = dict((src, results[src][3]) for src in folder_outputs)
+    if args.hash_report:
+        try:
+            with OutputFile(hash_report_path) as f:
+                write_hash_report(f, [(out_dir, [(src, hashes[src]) for src in group_sources])
+                                      for out_dir, group_sources in hash_groups])
+        except (OSError, IOError):
+            parser.print_usage(file=sys.stderr)
+            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                 " failed to write to '%s'" % args.hash_report
+            exit(1)
+
+    stats_path = args.stats and os.path.abspath(os.path.expanduser(args.stats))
+
+    #If git is enabled, start a new repo (if necessary), add the output files and commit
+    git_stats = None
+    if args.git:
+        import subprocess
+        git_root = os.path.abspath(os.path.expanduser(args.git))
+        git_paths = [os.path.relpath(path, git_root) for path in output_paths
+                     if not os.path.relpath(path, git_root).startswith(os.pardir)]
+
+        #Check if args.git is a git repo, or if it needs to be created. Unlike 'git status',
+        #'git rev-parse' doesn't look through the work tree to find that out
+        try:
+            git('rev-parse', '--git-dir', cwd=git_root)
+        except (subprocess.CalledProcessError, OSError):
+            #Create a git repo in the git root folder
+            try:
+                git('init', cwd=git_root)
+            except (subprocess.CalledProcessError, OSError):
+                #If it failed to create, exit
+                parser.print_usage(file=sys.stderr)
+                print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                     " something went wrong when creating a git repo"
+                exit(1)
+
+        try:
+            git_stats = {}
+            git_snapshot(git_paths, args.git_gc, git_stats, git_root)
+        except (subprocess.CalledProcessError, OSError, IOError):
+            parser.print_usage(file=sys.stderr)
+            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                 " something went wrong when committing to the git repo"
+            exit(1)
+
+    #Write the --stats report last, so it covers everything
+    if args.stats:
+        try:
+            with OutputFile(stats_path) as f:
+                write_stats(f, run_report([results[src][1] for src in sources], total_stats, git_stats, START_TIME),
+                            stats_path.endswith('.prom'))
+        except (OSError, IOError):
+            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " failed to write to '%s'" % args.stats
+            exit(1)
+
+    #Only a run that got all the way here counts as the last full run for --quick-check
+    if args.quick_check is not None:
+        try:
+            save_cache(quick_path, {'started': START_TIME, 'sources': source_stamps,
+                                    'outputs': file_stamps(output_paths)})
+        except (OSError, IOError):
+            print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                 " failed to save the --quick-check state to '%s'" % args.cache
+            exit(1)
+
+    #With --watch, keep going: every time source folders change, rewrite only the outputs they go into.
+    #Errors from here on are only reported, so that one bad update doesn't stop the watching
+    if args.watch is not None:
+        watcher = Watcher(dict((src, results[src][2]) for src in sources),
+                          dict((src, src in totals) for src in sources),
+                          dict((src, src in totals or hashes.get(src) is not None) for src in sources),
+                          args.watch_rescan)
+        source_stats = dict((src, results[src][1]) for src in sources)
+        hash_caches = dict((src, results[src][4]) for src in sources)
+        results = None  # The roots live in watcher now
+        last_commit = last_check = time.time()
+        uncommitted = False
+        while True:
+            #Source folders -i skipped (missing, empty or hung) are checked again every --watch-rescan seconds
+            skipped = [src for src in source_states if src not in watcher.roots]
+            timeouts = ([last_commit + args.watch_commit] if uncommitted else []) +\
+                       ([last_check + args.watch_rescan] if skipped else [])
+            changed = watcher.wait(args.watch, max(min(timeouts) - time.time(), 0) if timeouts else None)
+            started = time.time()
+            replanned = False
+            added = []
+            if skipped and started - last_check >= args.watch_rescan:
+                last_check = started
+                states = check_sources(skipped, args.mount_timeout)
+                if any(states[src] != source_states[src] for src in skipped):
+                    old_states = dict((src, source_states[src]) for src in skipped)
+                    source_states.update(states)
+                    sources, folder_outputs, totals, total_files, hash_groups, snapshot_paths, output_paths = \
+                        plan_outputs()
+                    #Walk the ones that came back, and watch them from now on
+                    for src in sources:
+                        if src in watcher.roots:
+                            continue
+                        try:
+                            sizes[src], source_stats[src], root, hashes[src], hash_caches[src] = scan_source(
+                                src, folder_outputs.get(src, []), src in totals,
+                                args.cache and os.path.expanduser(args.cache), args.full_rescan,
+                                snapshot_paths.get(src), args.index and os.path.abspath(os.path.expanduser(args.index)),
+                                True, args.hash_jobs if args.hash else 0)
+                        except JobError as e:
+                            print >> sys.stderr, "%s: error: %s" % (os.path.basename(sys.argv[0]), e)
+                            source_states[src] = old_states[src]    # Skipped until the next check
+                            continue
+                        watcher.add(src, root, src in totals, src in totals or hashes[src] is not None)
+                        added.append(src)
+                    sources, folder_outputs, totals, total_files, hash_groups, snapshot_paths, output_paths = \
+                        plan_outputs()
+                    if args.git:
+                        git_paths = [os.path.relpath(path, git_root) for path in output_paths
+                                     if not os.path.relpath(path, git_root).startswith(os.pardir)]
+                    total_stats = [{'output': out_file, 'output_bytes': 0} for out_file, sections in total_files]
+                    replanned = True
+            for src in changed:
+                if src in added:
+                    continue    # Just walked
+                source_started = time.time()
+                source_stats[src] = {'source': src, 'output_bytes': 0}
+                try:
+                    root = watcher.refresh(src, source_stats[src])
+                    if hashes.get(src) is not None:
+                        hashes[src], hash_caches[src] = hash_files(root, src, hash_caches[src], args.hash_jobs,
+                                                                   source_stats[src])
+                    sizes[src] = write_outputs(root, src, folder_outputs.get(src, []), src in totals,
+                                               snapshot_paths.get(src),
+                                               args.index and os.path.abspath(os.path.expanduser(args.index)),
+                                               source_stats[src], hashes.get(src))
+                except OSError:
+                    print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) + " failed to list '%s'" % src
+                except JobError as e:
+                    print >> sys.stderr, "%s: error: %s" % (os.path.basename(sys.argv[0]), e)
+                source_stats[src]['seconds'] = time.time() - source_started
+                source_stats[src]['entries_per_second'] = source_stats[src].get('entries', 0) / \
+                    source_stats[src]['seconds'] if source_stats[src]['seconds'] else 0.0
+            changed += added
+
+            for i, (out_file, sections) in enumerate(total_files):
+                if replanned or any(src in changed for src, message in sections):
+                    try:
+                        total_stats[i] = write_total(out_file, sections, sizes)
+                    except (OSError, IOError):
+                        print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                             " failed to write to '%s'" % out_file
+
+            if args.hash_report and any(src in folder_outputs for src in changed):
+                try:
+                    with OutputFile(hash_report_path) as f:
+                        write_hash_report(f, [(out_dir, [(src, hashes[src]) for src in group_sources])
+                                              for out_dir, group_sources in hash_groups])
+                except (OSError, IOError):
+                    print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                         " failed to write to '%s'" % args.hash_report
+
+            #Commits are batched, so a busy folder doesn't get a commit for every little change
+            uncommitted = bool(args.git) and (uncommitted or bool(changed) or replanned)
+            if uncommitted and time.time() - last_commit >= args.watch_commit:
+                try:
+                    git_stats = {}
+                    git_snapshot(git_paths, args.git_gc, git_stats, git_root)
+                except (subprocess.CalledProcessError, OSError, IOError):
+                    print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                         " something went wrong when committing to the git repo"
+                last_commit = time.time()
+                uncommitted = False
+
+            if args.stats and (changed or replanned):
+                try:
+                    with OutputFile(stats_path) as f:
+                        write_stats(f, run_report([source_stats[src] for src in sources], total_stats, git_stats,
+                                                  started), stats_path.endswith('.prom'))
+                except (OSError, IOError):
+                    print >> sys.stderr, "%s: error:" % os.path.basename(sys.argv[0]) +\
+                                         " failed to write to '%s'" % args.stats